@@ -1,52 +1,544 @@
 import tkinter as tk
-from eyeware.client import TrackerClient, TrackingConfidence
 import time
+import abc
 import numpy as np
 import ctypes
-import carla
-import cv2
 import math
-import pyautogui
 import csv
+import enum
+import collections
+import threading
+import atexit
+import io
+import json
+import os
+import queue
+import random
+import argparse
+import sys
+
+# The hardware and simulator packages are only needed for live sessions, replay and the tools run without them
+try:
+    from eyeware.client import TrackerClient, TrackingConfidence
+except ImportError:
+    TrackerClient = None
+
+    # Same levels as the Beam SDK, so recorded confidence values can be used without it
+    class TrackingConfidence(enum.Enum):
+        UNRELIABLE = 0
+        LOW = 1
+        MEDIUM = 2
+        HIGH = 3
+
+try:
+    import carla
+except ImportError:
+    carla = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import pyautogui
+except ImportError:
+    pyautogui = None
+
+# Semantic tags of the CARLA instance segmentation, the index is the value of the red channel
+SEMANTIC_TAGS = (
+    "Unlabeled",
+    "Roads",
+    "SideWalks",
+    "Building",
+    "Wall",
+    "Fence",
+    "Pole",
+    "TrafficLight",
+    "TrafficSign",
+    "Vegetation",
+    "Terrain",
+    "Sky",
+    "Pedestrian",
+    "Rider",
+    "Car",
+    "Truck",
+    "Bus",
+    "Train",
+    "Motorcycle",
+    "Bicycle",
+    "Static",
+    "Dynamic",
+    "Other",
+    "Water",
+    "RoadLine",
+    "Ground",
+    "Bridge",
+    "RailTrack",
+    "GuardRail"
+)
+
+# One entry for every possible red value, so a tag can be looked up without a range check
+RED_TO_TAG = SEMANTIC_TAGS + ("Unknown",) * (256 - len(SEMANTIC_TAGS))
+
+# Index of a tag in SEMANTIC_TAGS as it is stored in recordings, -1 means no result and -2 an unknown tag
+TAG_TO_INDEX = {tag: i for i, tag in enumerate(SEMANTIC_TAGS)}
+TAG_TO_INDEX.update({"Null": -1, "Unknown": -2})
+
+# Screen gaze as get_screen_gaze_info() of the Beam SDK returns it
+class ScreenGaze(collections.namedtuple("ScreenGaze", ("x", "y", "confidence", "is_lost"))):
+    __slots__ = ()
+
+# Interface of a gaze source. TrackerClient of the Beam SDK provides it, SyntheticGazeSource stands in without hardware.
+# The interfaces are abstract, so a backend that lacks a method fails when it is created and not during the session
+class GazeSource(abc.ABC):
+    connected = False
+
+    @abc.abstractmethod
+    def get_screen_gaze_info(self):
+        raise NotImplementedError
+
+# Deterministic gaze: fixations on random screen points with Gaussian noise, new samples at the given rate
+class SyntheticGazeSource(GazeSource):
+    def __init__(self, screen_size, rate=60, noise=15, fixation_duration=0.3, lost_probability=0.0, seed=0):
+        self.connected = True
+        self.screen_width, self.screen_height = screen_size
+        self.rate = rate
+        self.noise = noise  # Standard deviation in pixels
+        self.samples_per_fixation = max(int(fixation_duration*rate), 1)
+        self.lost_probability = lost_probability
+        self.random = random.Random(seed)
+
+        self.start = None
+        self.index = -1
+        self.target = (self.screen_width/2, self.screen_height/2)    # Point that is really looked at
+        self.gaze = None
+
+    # Like the tracker, polling faster than the rate returns the same sample again
+    def get_screen_gaze_info(self):
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+        index = int((now - self.start) * self.rate)
+        while self.index < index:
+            self.next_sample()
+        return self.gaze
+
+    # Samples are generated in order, so the sequence only depends on the seed
+    def next_sample(self):
+        self.index += 1
+        if self.index % self.samples_per_fixation == 0:
+            self.target = (self.random.uniform(0, self.screen_width), self.random.uniform(0, self.screen_height))
+
+        error = self.random.gauss(0, self.noise)
+        angle = self.random.uniform(0, 2*math.pi)
+        is_lost = self.random.random() < self.lost_probability
+        if is_lost:
+            confidence = TrackingConfidence.UNRELIABLE
+        elif abs(error) < self.noise:
+            confidence = TrackingConfidence.HIGH
+        elif abs(error) < 2*self.noise:
+            confidence = TrackingConfidence.MEDIUM
+        else:
+            confidence = TrackingConfidence.LOW
+        self.gaze = ScreenGaze(round(self.target[0] + error*math.cos(angle)), round(self.target[1] + error*math.sin(angle)), confidence, is_lost)
+
+    # The point that is really looked at, used as cursor position so logs contain ground truth
+    def cursor_position(self):
+        return round(self.target[0]), round(self.target[1])
+
+# Interface for the screen resolution and the cursor position
+class DisplayMetrics(abc.ABC):
+    @abc.abstractmethod
+    def screen_size(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def cursor_position(self):
+        raise NotImplementedError
+
+    # Refresh rate of the monitor in Hz
+    @abc.abstractmethod
+    def refresh_rate(self):
+        raise NotImplementedError
+
+class Win32DisplayMetrics(DisplayMetrics):
+    def screen_size(self):
+        user32 = ctypes.windll.user32   # Reads out current resolution
+        return user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
 
-class EyeTracker:
-    def __init__(self):
-        self.tracker = TrackerClient()  # Import the API for the Beam Eye-Tracker
+    # Vertical refresh rate of the primary monitor, 0 and 1 mean the hardware default, which is taken as 60 Hz
+    def refresh_rate(self):
+        user32 = ctypes.windll.user32
+        device_context = user32.GetDC(0)
+        try:
+            rate = ctypes.windll.gdi32.GetDeviceCaps(device_context, 116)   # VREFRESH
+        finally:
+            user32.ReleaseDC(0, device_context)
+        return rate if rate > 1 else 60
+
+    def cursor_position(self):
+        return pyautogui.position()
+
+# Fixed resolution, the cursor position comes from a function (e.g. SyntheticGazeSource.cursor_position) or is the middle
+class FixedDisplayMetrics(DisplayMetrics):
+    def __init__(self, screen_width, screen_height, cursor_position=None, refresh_rate=60):
+        self.size = (screen_width, screen_height)
+        self.cursor = cursor_position
+        self.rate = refresh_rate
+
+    def screen_size(self):
+        return self.size
+
+    def cursor_position(self):
+        if self.cursor is not None:
+            return self.cursor()
+        return self.size[0]//2, self.size[1]//2
+
+    def refresh_rate(self):
+        return self.rate
+
+# Interface of the driving simulator: sensors have listen(callback), stop() and destroy() like CARLA actors
+class Simulator(abc.ABC):
+    @abc.abstractmethod
+    def connect(self, server_address, port=2000):
+        raise NotImplementedError
+
+    # Spawns the vehicle with the segmentation camera and, if rgb_size is given, the rgb camera
+    @abc.abstractmethod
+    def example_situation(self, segmentation_size, rgb_size=None):
+        raise NotImplementedError
+
+    # In synchronous mode the simulation only advances by fixed_delta seconds when tick() is called, None switches it off
+    @abc.abstractmethod
+    def set_synchronous(self, fixed_delta):
+        raise NotImplementedError
+
+    # Advances a synchronous simulation by one step and returns the new frame number
+    @abc.abstractmethod
+    def tick(self):
+        raise NotImplementedError
+
+class CarlaSimulator(Simulator):
+    def connect(self, server_address, port=2000):
+        # Connect to server
+        self.client = carla.Client(server_address, port)
+        self.world = self.client.get_world()
+        self.spawn_points = self.world.get_map().get_spawn_points()
+
+    def set_synchronous(self, fixed_delta):
+        settings = self.world.get_settings()
+        settings.synchronous_mode = fixed_delta is not None
+        settings.fixed_delta_seconds = fixed_delta
+        self.world.apply_settings(settings)
+        # The autopilot has to step with the world, otherwise the traffic manager blocks the synchronous server
+        self.client.get_trafficmanager().set_synchronous_mode(fixed_delta is not None)
+
+    def tick(self):
+        return self.world.tick()
+
+    def example_situation(self, segmentation_size, rgb_size=None):
+        # Delete all sensors
+        all_sensor_actors = self.world.get_actors().filter('sensor.*')
+
+        for sensor in all_sensor_actors:
+            sensor.destroy()
         
-        # Define colors for the confidence output
-        self.green = "#00FF00"
-        self.yellow = "#FFFF00"
-        self.orange = "#FF8000"
-        self.red = "#FF0000"
-        self.gray = "#D9D9D9"
+        # Delete all vehicles
+        all_vehicle_actors = self.world.get_actors().filter('vehicle.*')
+
+        for vehicle in all_vehicle_actors:
+            vehicle.destroy()
+
+        # Spawn vehicles
+        vehicle_bp = self.world.get_blueprint_library().filter("vehicle.mercedes.sprinter")
+        start_point = self.spawn_points[0]
+        vehicle = self.world.try_spawn_actor(vehicle_bp[0], start_point)
+
+        # Add camera sensor instace segmentation
+        CAMERA_POS_Z=3.5
+        CAMERA_POS_X=2.5
+
+        camera_bp = self.world.get_blueprint_library().find('sensor.camera.instance_segmentation')
+        camera_bp.set_attribute('image_size_x', str(int(segmentation_size[0])))
+        camera_bp.set_attribute('image_size_y', str(int(segmentation_size[1])))
+        camera_bp.set_attribute('sensor_tick', '0.02')
+        camera_bp.set_attribute('fov', '80')
+
+        transform = carla.Transform(carla.Location(x=1.1, y=-0.5, z=5.8))
+        sensor = self.world.try_spawn_actor(camera_bp, transform, attach_to = vehicle)
+
+
+        # The rgb camera is only needed to show the driving scene, headless runs do not spawn it
+        sensor_rgb = None
+        if rgb_size is not None:
+            camera_rgb = self.world.get_blueprint_library().find('sensor.camera.rgb')
+            camera_rgb.set_attribute('image_size_x', str(int(rgb_size[0])))
+            camera_rgb.set_attribute('image_size_y', str(int(rgb_size[1])))
+            camera_rgb.set_attribute('sensor_tick', '0.02')
+            camera_rgb.set_attribute('fov', '80')
+
+            transform_rgb = carla.Transform(carla.Location(x=1.1, y=-0.5, z=2.8))
+            sensor_rgb = self.world.try_spawn_actor(camera_rgb, transform_rgb, attach_to = vehicle)  
+
+        vehicle.set_autopilot(True)
+
+        return sensor, sensor_rgb
+
+# Camera that renders BGRA segmentation frames: sky above, road below and cars that drive through the picture
+class FakeCameraSensor:
+    def __init__(self, width, height, sensor_tick=0.02, cars=5, seed=0):
+        self.width = int(width)
+        self.height = int(height)
+        self.sensor_tick = sensor_tick
+        self.frame = 0
+
+        self.background = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        self.background[:, :, 3] = 255
+        self.background[:self.height//2, :, 2] = SEMANTIC_TAGS.index("Sky")
+        self.background[self.height//2:, :, 2] = SEMANTIC_TAGS.index("Roads")
+
+        # Car: top row, height, width, start column, speed in pixels per frame, green and blue of the instance id
+        rng = random.Random(seed)
+        self.cars = []
+        for i in range(cars):
+            size = rng.randint(max(self.height//10, 1), max(self.height//4, 1))
+            top = rng.randint(self.height//2 - size//2, max(self.height - size, self.height//2 - size//2))
+            self.cars.append((top, size, 2*size, rng.randint(0, self.width), rng.choice((-1, 1))*rng.uniform(0.2, 2), i // 256, i % 256 + 1))
+
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.synchronous = False    # Frames are only rendered by tick() of the simulator
+        self.callback = None
+
+    def render(self, frame):
+        array = self.background.copy()
+        car_tag = SEMANTIC_TAGS.index("Car")
+        for top, height, width, start, speed, g, b in self.cars:
+            left = int(start + speed*frame) % (self.width + width) - width
+            columns = slice(max(left, 0), max(min(left + width, self.width), 0))
+            array[top:top+height, columns, 0] = b
+            array[top:top+height, columns, 1] = g
+            array[top:top+height, columns, 2] = car_tag
+        return SensorImage(memoryview(array).cast("B"), self.width, self.height, frame, frame*self.sensor_tick)
+
+    # Calls callback with a new frame every sensor_tick on a thread of its own, like a CARLA sensor
+    def listen(self, callback):
+        self.callback = callback
+        if self.synchronous:
+            return
+        def run():
+            scheduler = FixedRateScheduler(1/self.sensor_tick)
+            while not self.stop_event.is_set():
+                scheduler.wait()
+                self.frame += 1
+                callback(self.render(self.frame))
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=run, name="FakeCameraSensor", daemon=True)
+        self.thread.start()
+
+    # Renders the frame of a synchronous simulation step on the thread that ticks
+    def tick(self, frame):
+        callback = self.callback
+        if callback is not None:
+            self.frame = frame
+            callback(self.render(frame))
+
+    def stop(self):
+        self.callback = None
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def destroy(self):
+        self.stop()
+
+class FakeSimulator(Simulator):
+    def __init__(self, sensor_tick=0.02, seed=0):
+        self.sensor_tick = sensor_tick
+        self.seed = seed
+        self.fixed_delta = None
+        self.frame = 0
+        self.sensors = []
+
+    def connect(self, server_address, port=2000):
+        pass
+
+    def example_situation(self, segmentation_size, rgb_size=None):
+        sensor_tick = self.fixed_delta if self.fixed_delta is not None else self.sensor_tick
+        sensor = FakeCameraSensor(*segmentation_size, sensor_tick=sensor_tick, seed=self.seed)
+        sensor_rgb = FakeCameraSensor(*rgb_size, sensor_tick=sensor_tick, seed=self.seed) if rgb_size is not None else None
+        self.sensors = [camera for camera in (sensor, sensor_rgb) if camera is not None]
+        for camera in self.sensors:
+            camera.synchronous = self.fixed_delta is not None
+        return sensor, sensor_rgb
+
+    # Only affects cameras that are spawned afterwards
+    def set_synchronous(self, fixed_delta):
+        self.fixed_delta = fixed_delta
 
+    def tick(self):
+        self.frame += 1
+        for camera in self.sensors:
+            camera.tick(self.frame)
+        return self.frame
+
+class EyeTracker:
+    # Define colors for the confidence output
+    green = "#00FF00"
+    yellow = "#FFFF00"
+    orange = "#FF8000"
+    red = "#FF0000"
+    gray = "#D9D9D9"
+
+    def __init__(self, gaze_source=None):
+        self.tracker = gaze_source if gaze_source is not None else TrackerClient()  # Import the API for the Beam Eye-Tracker
+
+    # Determines the color based on the confidence value
+    @staticmethod
+    def confidence_color(confidence):
+        return {
+                TrackingConfidence.HIGH: EyeTracker.green,
+                TrackingConfidence.MEDIUM: EyeTracker.yellow,
+                TrackingConfidence.LOW: EyeTracker.orange,
+                TrackingConfidence.UNRELIABLE: EyeTracker.red
+        }.get(confidence, EyeTracker.gray)
 
     def get_trackingdata(self):
         if self.tracker.connected:  # Checks the connection to the Beam Eye-Tracker 
             screen_gaze = self.tracker.get_screen_gaze_info()   # Reads Screen-Gaze info given from Eye-Tracker
 
-            # Determines the color based on the confidence value:
-            confi_col = {
-                    TrackingConfidence.HIGH: self.green,
-                    TrackingConfidence.MEDIUM: self.yellow,
-                    TrackingConfidence.LOW: self.orange,
-                    TrackingConfidence.UNRELIABLE: self.red
-            }.get(screen_gaze.confidence, self.gray)
+            confi_col = EyeTracker.confidence_color(screen_gaze.confidence)
 
             return ["Tracker connected", screen_gaze.is_lost, screen_gaze.confidence, confi_col, screen_gaze.x, screen_gaze.y]
         else:
             return ["Tracker not connected", "Null", "Null", "Null", "Null", "Null"]
         
+# Adaptive low-pass filter for the gaze (One Euro filter, Casiez et al. 2012): smooths strongly while the gaze rests and
+# follows quickly when it moves. Samples of lower confidence pull the filtered point less, lost samples hold the last point
+class GazeFilter:
+    __slots__ = ("min_cutoff", "beta", "derivative_cutoff", "confidence_weights", "x", "y", "dx", "dy", "timestamp", "samples", "compute_time", "max_compute_time", "lag")
+
+    def __init__(self, min_cutoff=1.0, beta=0.005, derivative_cutoff=1.0, confidence_weights=None):
+        self.min_cutoff = min_cutoff    # Hz, cutoff frequency while the gaze rests
+        self.beta = beta    # Hz per px/s, the cutoff rises with the gaze speed
+        self.derivative_cutoff = derivative_cutoff  # Hz, smoothing of the speed estimate
+        if confidence_weights is None:
+            confidence_weights = {
+                TrackingConfidence.HIGH: 1.0,
+                TrackingConfidence.MEDIUM: 0.7,
+                TrackingConfidence.LOW: 0.4,
+                TrackingConfidence.UNRELIABLE: 0.1
+            }
+        self.confidence_weights = confidence_weights
+        self.reset()
+
+        # Cost and delay of the filter, see stats()
+        self.samples = 0
+        self.compute_time = 0.0
+        self.max_compute_time = 0.0
+        self.lag = 0.0
+
+    # Parameters as keyword arguments of GazeFilter, recordings store them so replay.py can apply the same filter
+    def settings(self):
+        return {"min_cutoff": self.min_cutoff, "beta": self.beta, "derivative_cutoff": self.derivative_cutoff}
+
+    def reset(self):
+        self.x = None
+        self.y = None
+        self.dx = 0.0
+        self.dy = 0.0
+        self.timestamp = None
+
+    @staticmethod
+    def alpha(duration, cutoff):
+        return 1 / (1 + 1 / (2*math.pi*cutoff*duration))
+
+    # One filter step with the sample at timestamp, returns the filtered point
+    def step(self, x, y, timestamp, weight):
+        if self.x is None:
+            self.x, self.y, self.timestamp = x, y, timestamp
+            return x, y
+        duration = timestamp - self.timestamp
+        if duration <= 0:
+            return self.x, self.y
+        self.timestamp = timestamp
+
+        alpha = GazeFilter.alpha(duration, self.derivative_cutoff)
+        self.dx += alpha * ((x - self.x)/duration - self.dx)
+        self.dy += alpha * ((y - self.y)/duration - self.dy)
+
+        alpha = GazeFilter.alpha(duration, self.min_cutoff + self.beta*math.hypot(self.dx, self.dy)) * weight
+        self.x += alpha * (x - self.x)
+        self.y += alpha * (y - self.y)
+        self.lag += duration * (1 - alpha) / alpha  # Delay of an exponential filter with this alpha
+        return self.x, self.y
+
+    # Filters x and y of the tracking data in place like CorrectCurvature.correct, the result is rounded to whole pixels
+    def filter(self, tracking_data, timestamp):
+        start = time.perf_counter()
+        if tracking_data[0] != "Tracker connected":
+            self.reset()
+            return tracking_data
+
+        if tracking_data[1]:
+            if self.x is not None:
+                tracking_data[4], tracking_data[5] = round(self.x), round(self.y)
+        else:
+            x, y = self.step(tracking_data[4], tracking_data[5], timestamp, self.confidence_weights.get(tracking_data[2], 1.0))
+            tracking_data[4], tracking_data[5] = round(x), round(y)
+
+        compute_time = time.perf_counter() - start
+        self.samples += 1
+        self.compute_time += compute_time
+        self.max_compute_time = max(self.max_compute_time, compute_time)
+        return tracking_data
+
+    # Filters whole log columns with the same steps as filter(). NaN means not connected, confidence holds the values
+    # of TrackingConfidence
+    def filter_batch(self, timestamps, x, y, confidence=None, is_lost=None):
+        count = len(x)
+        weights = {level.value: weight for level, weight in self.confidence_weights.items()}
+        confidence = np.asarray(confidence).tolist() if confidence is not None else [None] * count
+        is_lost = np.asarray(is_lost).tolist() if is_lost is not None else [False] * count
+        filtered_x = np.full(count, np.nan)
+        filtered_y = np.full(count, np.nan)
+
+        clock = time.perf_counter
+        for i, (timestamp, sample_x, sample_y) in enumerate(zip(np.asarray(timestamps, dtype=np.float64).tolist(), np.asarray(x, dtype=np.float64).tolist(), np.asarray(y, dtype=np.float64).tolist())):
+            start = clock()
+            if math.isnan(sample_x) or math.isnan(sample_y):
+                self.reset()
+                continue
+            # Lost samples before the first filtered one keep their raw value like in filter()
+            if is_lost[i]:
+                if self.x is not None:
+                    sample_x, sample_y = self.x, self.y
+            else:
+                sample_x, sample_y = self.step(sample_x, sample_y, timestamp, weights.get(confidence[i], 1.0))
+            filtered_x[i], filtered_y[i] = round(sample_x), round(sample_y)
+
+            compute_time = clock() - start
+            self.samples += 1
+            self.compute_time += compute_time
+            self.max_compute_time = max(self.max_compute_time, compute_time)
+        return filtered_x, filtered_y
+
+    # Mean and longest compute time and the mean delay of the filtered gaze behind the raw gaze
+    def stats(self):
+        if self.samples == 0:
+            return "no samples"
+        return f"{self.samples} samples, {self.compute_time/self.samples*1e6:.1f} µs per sample (longest {self.max_compute_time*1e6:.1f} µs), lag {self.lag/self.samples*1000:.1f} ms"
+
 class Calibration:
-    def __init__(self):
-        pass
+    def __init__(self, gaze_source=None, display_metrics=None):
+        self.gaze_source = gaze_source
+        self.display_metrics = display_metrics if display_metrics is not None else Win32DisplayMetrics()
 
     def calibration(self):
-        tracker = TrackerClient() # Import the API for the Beam Eye-Tracker
+        tracker = self.gaze_source if self.gaze_source is not None else TrackerClient() # Import the API for the Beam Eye-Tracker
         
-        user32 = ctypes.windll.user32   # Reads out current resolution
-        screen_width = user32.GetSystemMetrics(0)
-        screen_height = user32.GetSystemMetrics(1)
+        screen_width, screen_height = self.display_metrics.screen_size()   # Reads out current resolution
         middle_width = screen_width/2
         middle_height = screen_height/2
 
@@ -110,6 +602,66 @@ class Calibration:
         else:
             return "Tracker not connected"
         
+    # Targets of a columns x rows grid that covers the screen up to margin (share of width and height) at the borders
+    @staticmethod
+    def grid_targets(screen_width, screen_height, columns=3, rows=3, margin=0.1):
+        xs = np.linspace(margin * screen_width, (1 - margin) * screen_width, columns) if columns > 1 else [screen_width / 2]
+        ys = np.linspace(margin * screen_height, (1 - margin) * screen_height, rows) if rows > 1 else [screen_height / 2]
+        return [(round(float(x)), round(float(y))) for y in ys for x in xs]
+
+    # Shows the targets of a grid one after the other on a full screen window. On every target the raw gaze is sampled
+    # at rate after settle_time, until samples_per_target samples that are not lost are collected or timeout is over.
+    # Escape aborts. Returns the targets and the samples per target for CalibrationMapping.fit
+    def calibrate_grid(self, columns=3, rows=3, samples_per_target=30, settle_time=0.8, rate=30, timeout=5.0, margin=0.1):
+        tracker = self.gaze_source if self.gaze_source is not None else TrackerClient() # Import the API for the Beam Eye-Tracker
+        if not tracker.connected:
+            return "Tracker not connected"
+
+        screen_width, screen_height = self.display_metrics.screen_size()
+        self.targets = Calibration.grid_targets(screen_width, screen_height, columns, rows, margin)
+        self.samples = [[] for target in self.targets]
+        self.aborted = False
+
+        calibration = tk.Tk()
+        calibration.title("Calibration")
+        calibration.geometry(f"{screen_width}x{screen_height}+0+0")
+        calibration.overrideredirect(True)
+        canvas = tk.Canvas(calibration, width=screen_width, height=screen_height, bg="white", highlightthickness=0)
+        canvas.place(x=0, y=0)
+        marker = canvas.create_oval(0, 0, 0, 0, fill="red", outline="")
+
+        def abort(event):
+            self.aborted = True
+            calibration.destroy()
+        calibration.bind("<Escape>", abort)
+
+        # The marker turns green while the samples are taken
+        def show_target(index):
+            if index == len(self.targets):
+                calibration.destroy()
+                return
+            x, y = self.targets[index]
+            canvas.coords(marker, x-12, y-12, x+12, y+12)
+            canvas.itemconfigure(marker, fill="red")
+            shown = time.perf_counter()
+            calibration.after(round(settle_time*1000), lambda: sample_target(index, shown))
+
+        def sample_target(index, shown):
+            canvas.itemconfigure(marker, fill="green")
+            screen_gaze = tracker.get_screen_gaze_info()
+            if not screen_gaze.is_lost:
+                self.samples[index].append((screen_gaze.x, screen_gaze.y))
+            if len(self.samples[index]) >= samples_per_target or time.perf_counter() - shown > timeout:
+                show_target(index + 1)
+            else:
+                calibration.after(round(1000/rate), lambda: sample_target(index, shown))
+
+        calibration.after(100, lambda: show_target(0))
+        calibration.mainloop()
+        if self.aborted:
+            return None
+        return self.targets, self.samples
+
     # Calculates hard offset of Eye Tracker data and button position
     def calculate_offset(self):
         
@@ -143,7 +695,13 @@ class Calibration:
     
 
 class CorrectCurvature:
-    def __init__(self):
+    # Coefficients of the left (c, d, p, gamma) and right (c2, d2, p2, gamma2) V-function
+    coefficient_names = ("c", "d", "p", "gamma", "c2", "d2", "p2", "gamma2")
+
+    # Attributes the correction depends on. Changing one of them discards the lookup table
+    table_attributes = coefficient_names + ("screen_width", "middle_width")
+
+    def __init__(self, use_table=True, screen_width=None):
 
         #self.k_r=1 # additional correction coefficient for right screen half for quadratic function (not used in V-function)
 
@@ -157,34 +715,441 @@ class CorrectCurvature:
         self.p2=1.5
         self.gamma2=0.0012
 
-        user32 = ctypes.windll.user32   # Reads out current resolution
-        self.screen_width = user32.GetSystemMetrics(0)
+        if screen_width is None:
+            screen_width = Win32DisplayMetrics().screen_size()[0]   # Reads out current resolution
+        self.screen_width = screen_width
         self.middle_width = self.screen_width/2
 
+        # With the table the correction of an on-screen pixel column is a single list lookup
+        self.use_table = use_table
+        self.table = None
+
+    def __setattr__(self, name, value):
+        if name in CorrectCurvature.table_attributes:
+            object.__setattr__(self, "table", None)
+        object.__setattr__(self, name, value)
+
+    # V-function correction of a single x value
+    def correct_x(self, x):
+        # Checks if left or right correction is used 
+        # Left side
+        if x<=self.middle_width:
+            #correction_value = pow((self.c*(self.middle_width-x)),2) # quadratic function with power 2
+            #correction_value = pow((self.c*(self.middle_width-x)),4) # quadratic function with power 4
+            correction_value = (pow((self.c*abs(self.middle_width-x)+self.d),self.p))*(1-math.exp(-self.gamma*abs(self.middle_width-x))) # V-function
+            return round(x+correction_value)
+
+        # Right side
+        else:
+            #correction_value = pow((self.c*(self.middle_width-x)),2)*self.k_r # quadratic function with power 2
+            #correction_value = pow((self.c*(self.middle_width-x)),4)*self.k_r # quadratic function with power 4
+            correction_value = (pow((self.c2*abs(self.middle_width-x)+self.d2),self.p2))*(1-math.exp(-self.gamma2*abs(self.middle_width-x))) # V-function
+            return round(x-correction_value)
+
+    # Precomputes the integer offset of every pixel column. Columns up to the middle use the left coefficients, the others the right ones
+    def build_table(self):
+        table = [self.correct_x(x) - x for x in range(int(self.screen_width) + 1)]
+        self.table = table
+        return table
+
     def correct(self, tracking_data):
         if(tracking_data[4]!="Null"):
-            # Checks if left or right correction is used 
-            # Left side
-            if tracking_data[4]<=self.middle_width:
-                #correction_value = pow((self.c*(self.middle_width-tracking_data[4])),2) # quadratic function with power 2
-                #correction_value = pow((self.c*(self.middle_width-tracking_data[4])),4) # quadratic function with power 4
-                correction_value = (pow((self.c*abs(self.middle_width-tracking_data[4])+self.d),self.p))*(1-math.exp(-self.gamma*abs(self.middle_width-tracking_data[4]))) # V-function
-                tracking_data[4]=round(tracking_data[4]+correction_value)
-
-            # Right side
+            x = tracking_data[4]
+            if self.use_table:
+                table = self.table
+                if table is None:
+                    table = self.build_table()
+
+                # Only whole pixel columns on the screen are in the table, everything else is calculated
+                column = int(x)
+                if column == x and 0 <= column < len(table):
+                    tracking_data[4] = column + table[column]
+                    return tracking_data
+
+            tracking_data[4] = self.correct_x(x)
+
+        return tracking_data
+
+    # Corrects whole arrays of raw gaze values in one pass with the same halves and rounding as correct(). Missing values are NaN
+    def correct_batch(self, x, y=None):
+        x = np.asarray(x, dtype=np.float64)
+        corrected = np.full(x.shape, np.nan)
+
+        # Whole on-screen columns come from the lookup table, so the result is identical to correct()
+        table = np.asarray(self.table if self.table is not None else self.build_table(), dtype=np.float64)
+        valid = ~np.isnan(x)
+        column = np.zeros(x.shape, dtype=np.int64)
+        column[valid] = x[valid]
+        on_table = valid & (column == x) & (column >= 0) & (column < len(table))
+        corrected[on_table] = column[on_table] + table[column[on_table]]
+
+        # All other values are calculated with the V-function
+        rest = valid & ~on_table
+        x_rest = x[rest]
+        distance = np.abs(self.middle_width - x_rest)
+        left = x_rest <= self.middle_width
+        correction_left = np.power(self.c*distance+self.d, self.p)*(1-np.exp(-self.gamma*distance))
+        correction_right = np.power(self.c2*distance+self.d2, self.p2)*(1-np.exp(-self.gamma2*distance))
+        corrected[rest] = np.round(np.where(left, x_rest+correction_left, x_rest-correction_right))
+
+        if y is None:
+            return corrected
+        return corrected, np.asarray(y, dtype=np.float64)
+
+    # Applies the current coefficients to the raw gaze columns of a csv_Logger file and writes the result to a new file
+    # The raw gaze can be smoothed with a GazeFilter first, CSV logs have no timestamps so the samples are taken as evenly spaced at rate
+    def correct_log(self, input_filename, output_filename, gaze_filter=None, rate=30):
+        header, columns = csv_Logger.read_log(input_filename)
+        x, y = columns["Beam Eye Pos. x"], columns["Beam Eye Pos. y"]
+        if gaze_filter is not None:
+            x, y = gaze_filter.filter_batch(np.arange(len(x)) / rate, x, y)
+        columns["Adjusted x"], columns["Adjusted y"] = self.correct_batch(x, y)
+        csv_Logger.write_log(output_filename, header, columns)
+        return len(columns["Adjusted x"])
+
+    # Writes the coefficients to a JSON profile, extra entries (e.g. fit residuals) are stored alongside
+    def save_profile(self, filename, extra=None):
+        profile = {
+            "screen_width": self.screen_width,
+            "coefficients": {name: getattr(self, name) for name in CorrectCurvature.coefficient_names}
+        }
+        if extra:
+            profile.update(extra)
+        with open(filename, mode="w") as file:
+            json.dump(profile, file, indent=4)
+
+    # Loads the coefficients of a profile written by save_profile or fit_curvature.py
+    def load_profile(self, filename):
+        with open(filename) as file:
+            profile = json.load(file)
+        for name in CorrectCurvature.coefficient_names:
+            setattr(self, name, float(profile["coefficients"][name]))
+        if profile.get("screen_width", self.screen_width) != self.screen_width:
+            print(f"Curvature profile {filename} was fitted for a screen width of {profile['screen_width']} px, the current screen has {self.screen_width} px")
+        return profile
+
+class CurvatureFitter:
+    def __init__(self, screen_width, screen_height, max_iterations=200, max_error=None):
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.middle_width = screen_width/2
+        self.max_iterations = max_iterations
+        self.max_error = max_error  # Samples further than this from the cursor are ignored (looked somewhere else)
+
+        self.cursor_x = np.empty(0)
+        self.cursor_y = np.empty(0)
+        self.raw_x = np.empty(0)
+        self.raw_y = np.empty(0)
+
+    # Adds the cursor and raw gaze columns of one or more csv_Logger files, rows without gaze are skipped
+    def load_logs(self, filenames):
+        for filename in filenames:
+            header, columns = csv_Logger.read_log(filename)
+            cursor_x, cursor_y = columns["Cursor x"], columns["Cursor y"]
+            raw_x, raw_y = columns["Beam Eye Pos. x"], columns["Beam Eye Pos. y"]
+
+            valid = ~(np.isnan(cursor_x) | np.isnan(cursor_y) | np.isnan(raw_x) | np.isnan(raw_y))
+            if self.max_error is not None:
+                valid &= np.hypot(raw_x - cursor_x, raw_y - cursor_y) <= self.max_error
+
+            self.cursor_x = np.concatenate((self.cursor_x, cursor_x[valid]))
+            self.cursor_y = np.concatenate((self.cursor_y, cursor_y[valid]))
+            self.raw_x = np.concatenate((self.raw_x, raw_x[valid]))
+            self.raw_y = np.concatenate((self.raw_y, raw_y[valid]))
+        return len(self.raw_x)
+
+    # V-function and its derivatives with respect to (c, d, p, gamma) for all distances at once
+    @staticmethod
+    def v_function(distance, c, d, p, gamma):
+        base = c*distance + d
+        power = np.power(base, p)
+        decay = np.exp(-gamma*distance)
+        value = power*(1-decay)
+        jacobian = np.column_stack((
+            p*power/base*distance*(1-decay),
+            p*power/base*(1-decay),
+            power*np.log(base)*(1-decay),
+            power*distance*decay
+        ))
+        return value, jacobian
+
+    # Levenberg-Marquardt least squares fit of one screen half, target is the correction that would have hit the cursor
+    def fit_half(self, distance, target, initial):
+        params = np.array(initial, dtype=np.float64)
+        value, jacobian = CurvatureFitter.v_function(distance, *params)
+        cost = np.sum((value - target)**2)
+        damping = 1e-3
+
+        for iteration in range(self.max_iterations):
+            residual = value - target
+            hessian = jacobian.T @ jacobian
+            gradient = jacobian.T @ residual
+            scale = np.diag(np.diag(hessian)) + 1e-12*np.eye(4)
+
+            improved = False
+            while damping < 1e10:
+                step = np.linalg.solve(hessian + damping*scale, -gradient)
+                candidate = params + step
+                # The base of the power has to stay positive on the whole half
+                if candidate[0]*distance.max() + candidate[1] > 0 and candidate[1] > 0 and candidate[3] >= 0:
+                    with np.errstate(over="ignore", invalid="ignore"):
+                        candidate_value, candidate_jacobian = CurvatureFitter.v_function(distance, *candidate)
+                    candidate_cost = np.sum((candidate_value - target)**2)
+                    if np.isfinite(candidate_cost) and candidate_cost < cost:
+                        improved = True
+                        break
+                damping *= 4
+
+            if not improved:
+                break
+            converged = cost - candidate_cost < 1e-10*cost
+            params, value, jacobian, cost = candidate, candidate_value, candidate_jacobian, candidate_cost
+            damping = max(damping/4, 1e-12)
+            if converged:
+                break
+
+        return params
+
+    # Fits the left and right V-function, starting from the coefficients of the given CorrectCurvature
+    def fit(self, correct_curvature):
+        if len(self.raw_x) == 0:
+            raise ValueError("No valid samples to fit")
+
+        left = self.raw_x <= self.middle_width
+        distance = np.abs(self.middle_width - self.raw_x)
+        fitted = {}
+
+        for side, mask, sign, names in ((0, left, 1, ("c", "d", "p", "gamma")), (1, ~left, -1, ("c2", "d2", "p2", "gamma2"))):
+            initial = [getattr(correct_curvature, name) for name in names]
+            if np.count_nonzero(mask) < 4:
+                params = initial    # Too few samples on this half, the old coefficients are kept
             else:
-                #correction_value = pow((self.c*(self.middle_width-tracking_data[4])),2)*self.k_r # quadratic function with power 2
-                #correction_value = pow((self.c*(self.middle_width-tracking_data[4])),4)*self.k_r # quadratic function with power 4
-                correction_value = (pow((self.c2*abs(self.middle_width-tracking_data[4])+self.d2),self.p2))*(1-math.exp(-self.gamma2*abs(self.middle_width-tracking_data[4]))) # V-function
-                tracking_data[4]=round(tracking_data[4]-correction_value)
-                
+                params = self.fit_half(distance[mask], sign*(self.cursor_x[mask] - self.raw_x[mask]), initial)
+            fitted.update(zip(names, (float(value) for value in params)))
+
+        return fitted
+
+    # Mean absolute and RMS error of the corrected gaze per grid region of the screen, the region is taken from the cursor
+    def residuals(self, correct_curvature, section_amount=16):
+        corrected_x, corrected_y = correct_curvature.correct_batch(self.raw_x, self.raw_y)
+        error_x = corrected_x - self.cursor_x
+        error = np.hypot(error_x, corrected_y - self.cursor_y)
+
+        sections = int(section_amount ** 0.5)
+        region_x = np.clip((self.cursor_x // (self.screen_width / sections)).astype(int), 0, sections-1)
+        region_y = np.clip((self.cursor_y // (self.screen_height / sections)).astype(int), 0, sections-1)
+
+        report = {}
+        for coordinate_y in range(sections):
+            for coordinate_x in range(sections):
+                mask = (region_x == coordinate_x) & (region_y == coordinate_y)
+                count = int(np.count_nonzero(mask))
+                if count:
+                    report[f"({coordinate_x}, {coordinate_y})"] = {
+                        "samples": count,
+                        "mean abs error x": float(np.mean(np.abs(error_x[mask]))),
+                        "rms error x": float(np.sqrt(np.mean(error_x[mask]**2))),
+                        "rms error": float(np.sqrt(np.mean(error[mask]**2)))
+                    }
+        report["all"] = {
+            "samples": len(error),
+            "mean abs error x": float(np.mean(np.abs(error_x))),
+            "rms error x": float(np.sqrt(np.mean(error_x**2))),
+            "rms error": float(np.sqrt(np.mean(error**2)))
+        }
+        return report
+
+# Least-squares mapping from the curvature corrected gaze to the screen, fitted to the samples of a grid calibration.
+# Degree 1 is an affine mapping, higher degrees add the polynomial terms of x and y. Curvature correction and mapping
+# are combined in one table with the result for every on-screen pixel, so correct() is a single lookup like
+# CorrectCurvature.correct(). Everything else is calculated with the same operations, so both give the same result
+class CalibrationMapping:
+    def __init__(self, correct_curvature, screen_width, screen_height, degree=1, use_table=True):
+        self.correct_curvature = correct_curvature
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.degree = degree
+        # Powers of x and y of every term, constant and linear terms first
+        self.exponents = [(i, total - i) for total in range(degree + 1) for i in range(total, -1, -1)]
+        # Identity: x and y are only taken over
+        self.coefficients = [(0.0, 0.0)] * len(self.exponents)
+        self.coefficients[1] = (float(screen_width), 0.0)
+        self.coefficients[2] = (0.0, float(screen_height))
+
+        self.use_table = use_table
+        self.table_x = None
+        self.table_y = None
+
+    # Terms of the polynomial for scalars or arrays. Coordinates are scaled to the screen size, so the least squares
+    # problem is well conditioned, and every power is multiplied out in the same order for scalars and arrays
+    def terms(self, x, y):
+        u = x / self.screen_width
+        v = y / self.screen_height
+        terms = []
+        for power_x, power_y in self.exponents:
+            term = 1.0
+            for i in range(power_x):
+                term = term * u
+            for i in range(power_y):
+                term = term * v
+            terms.append(term)
+        return terms
+
+    # Mapped position of curvature corrected gaze, scalars or arrays
+    def evaluate(self, x, y):
+        mapped_x = 0.0
+        mapped_y = 0.0
+        for term, (coefficient_x, coefficient_y) in zip(self.terms(x, y), self.coefficients):
+            mapped_x = mapped_x + coefficient_x * term
+            mapped_y = mapped_y + coefficient_y * term
+        return mapped_x, mapped_y
+
+    # Keeps the samples of one target within threshold times the scaled median absolute deviation of the median in
+    # x and y. Blinks and glances to somewhere else do not pull the fit this way. The tracker delivers whole pixels and
+    # often the same one several times, so the deviation is at least min_mad pixels
+    @staticmethod
+    def reject_outliers(x, y, threshold=3.0, min_mad=1.0):
+        keep = ~(np.isnan(x) | np.isnan(y))
+        if not np.any(keep):
+            return keep
+        for values in (x, y):
+            deviation = np.abs(values - np.median(values[keep]))
+            mad = max(1.4826 * np.median(deviation[keep]), min_mad)
+            keep &= deviation <= threshold * mad
+        return keep
+
+    # Fits the mapping to the raw gaze samples of every target (targets: list of (x, y), samples: list of arrays or
+    # lists of (x, y) per target). Returns the RMS error of every target before and after the fit
+    def fit(self, targets, samples, threshold=3.0):
+        target_x, target_y, raw_x, raw_y = [], [], [], []
+        used_targets = 0
+        for (x, y), target_samples in zip(targets, samples):
+            target_samples = np.asarray(target_samples, dtype=np.float64).reshape(-1, 2)
+            if len(target_samples) == 0:
+                continue
+            keep = CalibrationMapping.reject_outliers(target_samples[:, 0], target_samples[:, 1], threshold)
+            count = int(np.count_nonzero(keep))
+            if count == 0:
+                continue
+            used_targets += 1
+            target_x.append(np.full(count, x, dtype=np.float64))
+            target_y.append(np.full(count, y, dtype=np.float64))
+            raw_x.append(target_samples[keep, 0])
+            raw_y.append(target_samples[keep, 1])
+        if used_targets < len(self.exponents):
+            raise ValueError(f"{used_targets} targets with samples, a mapping of degree {self.degree} needs at least {len(self.exponents)}")
+
+        target_x, target_y = np.concatenate(target_x), np.concatenate(target_y)
+        corrected_x, corrected_y = self.correct_curvature.correct_batch(np.concatenate(raw_x), np.concatenate(raw_y))
+        before = np.hypot(corrected_x - target_x, corrected_y - target_y)
+
+        design = np.column_stack([np.broadcast_to(term, corrected_x.shape) for term in self.terms(corrected_x, corrected_y)])
+        solution = np.linalg.lstsq(design, np.column_stack((target_x, target_y)), rcond=None)[0]
+        self.coefficients = [(float(coefficient_x), float(coefficient_y)) for coefficient_x, coefficient_y in solution]
+        self.table_x = self.table_y = None
+
+        mapped_x, mapped_y = self.evaluate(corrected_x, corrected_y)
+        after = np.hypot(mapped_x - target_x, mapped_y - target_y)
+        report = {}
+        for x, y in targets:
+            mask = (target_x == x) & (target_y == y)
+            if np.any(mask):
+                report[f"({x:.0f}, {y:.0f})"] = {
+                    "samples": int(np.count_nonzero(mask)),
+                    "rms error before": float(np.sqrt(np.mean(before[mask]**2))),
+                    "rms error": float(np.sqrt(np.mean(after[mask]**2)))
+                }
+        report["all"] = {
+            "samples": len(after),
+            "rejected": sum(len(np.asarray(target_samples).reshape(-1, 2)) for target_samples in samples) - len(after),
+            "rms error before": float(np.sqrt(np.mean(before**2))),
+            "rms error": float(np.sqrt(np.mean(after**2)))
+        }
+        return report
+
+    # Precomputes curvature correction and mapping for every pixel of the screen, in blocks of rows to bound the memory
+    def build_table(self, block_rows=256):
+        columns = np.arange(self.screen_width + 1, dtype=np.float64)
+        corrected_columns = self.correct_curvature.correct_batch(columns)[np.newaxis, :]
+        table_x = np.empty((self.screen_height + 1, self.screen_width + 1), dtype=np.int32)
+        table_y = np.empty((self.screen_height + 1, self.screen_width + 1), dtype=np.int32)
+        for first in range(0, self.screen_height + 1, block_rows):
+            rows = np.arange(first, min(first + block_rows, self.screen_height + 1), dtype=np.float64)[:, np.newaxis]
+            mapped_x, mapped_y = self.evaluate(corrected_columns, rows)
+            table_x[first:first+len(rows)] = np.round(np.broadcast_to(mapped_x, (len(rows), len(columns))))
+            table_y[first:first+len(rows)] = np.round(np.broadcast_to(mapped_y, (len(rows), len(columns))))
+        self.table_x = table_x
+        self.table_y = table_y
+        return table_x, table_y
+
+    # Replaces CorrectCurvature.correct() in the acquisition, x and y are corrected together
+    def correct(self, tracking_data):
+        x, y = tracking_data[4], tracking_data[5]
+        if x == "Null" or y == "Null":
+            return tracking_data
+
+        if self.use_table:
+            table_x = self.table_x
+            if table_x is None:
+                table_x = self.build_table()[0]
+
+            # Only whole pixels on the screen are in the table, everything else is calculated
+            column, row = int(x), int(y)
+            if column == x and row == y and 0 <= column <= self.screen_width and 0 <= row <= self.screen_height:
+                tracking_data[4] = table_x.item(row, column)
+                tracking_data[5] = self.table_y.item(row, column)
+                return tracking_data
+
+        mapped_x, mapped_y = self.evaluate(float(self.correct_curvature.correct_x(x)), float(y))
+        tracking_data[4] = round(mapped_x)
+        tracking_data[5] = round(mapped_y)
         return tracking_data
 
+    # Arrays of raw gaze, missing values are NaN
+    def correct_batch(self, x, y):
+        corrected_x, corrected_y = self.correct_curvature.correct_batch(x, y)
+        mapped_x, mapped_y = self.evaluate(corrected_x, corrected_y)
+        return np.round(mapped_x), np.round(mapped_y)
+
+    # Profile of one user at one resolution, e.g. calibration_profiles/anna_2560x1440.json
+    @staticmethod
+    def profile_filename(user, screen_width, screen_height, directory="calibration_profiles"):
+        return os.path.join(directory, f"{user}_{screen_width}x{screen_height}.json")
+
+    # The curvature coefficients are stored as well, the mapping was fitted on top of them
+    def save_profile(self, filename, extra=None):
+        profile = {
+            "screen_width": self.screen_width,
+            "screen_height": self.screen_height,
+            "degree": self.degree,
+            "coefficients": self.coefficients,
+            "curvature": {name: getattr(self.correct_curvature, name) for name in CorrectCurvature.coefficient_names}
+        }
+        if extra:
+            profile.update(extra)
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, mode="w") as file:
+            json.dump(profile, file, indent=4)
+
+    # Loads a profile written by save_profile, also sets the curvature coefficients it was fitted with
+    @staticmethod
+    def load_profile(filename, correct_curvature, use_table=True):
+        with open(filename) as file:
+            profile = json.load(file)
+        for name in CorrectCurvature.coefficient_names:
+            setattr(correct_curvature, name, float(profile["curvature"][name]))
+        mapping = CalibrationMapping(correct_curvature, profile["screen_width"], profile["screen_height"], profile["degree"], use_table)
+        mapping.coefficients = [(float(coefficient_x), float(coefficient_y)) for coefficient_x, coefficient_y in profile["coefficients"]]
+        return mapping
+
 class LookDirection:
-    def __init__(self):
-        user32 = ctypes.windll.user32   # Reads out current resolution
-        self.screen_width = user32.GetSystemMetrics(0)
-        self.screen_height = user32.GetSystemMetrics(1)
+    def __init__(self, screen_width=None, screen_height=None, aoi_registry=None):
+        if screen_width is None or screen_height is None:
+            screen_width, screen_height = Win32DisplayMetrics().screen_size()   # Reads out current resolution
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.aoi_registry = aoi_registry    # Named screen areas such as mirrors and dashboard, see AOIRegistry
 
         # Defines roughly the looking direction:
         self.lookdir = {
@@ -197,16 +1162,22 @@ class LookDirection:
     # Selects based on Eye-Tracker data, where one is looking
     def look_direction_rough(self, tracking_data):
         if tracking_data[0] == "Tracker connected":
-            if tracking_data[4] < self.screen_width/2 and tracking_data[5] < self.screen_height/2:
-                lookdir = self.lookdir.get(0, "Unknown")
-            elif tracking_data[4] > self.screen_width/2 and tracking_data[5] < self.screen_height/2:
-                lookdir = self.lookdir.get(1, "Unknown")
-            elif tracking_data[4] < self.screen_width/2 and tracking_data[5] > self.screen_height/2:
-                lookdir = self.lookdir.get(2, "Unknown")
-            else:
-                lookdir = self.lookdir.get(3, "Unknown")
+            lookdir = self.lookdir.get(self.look_direction_index(tracking_data), "Unknown")
             return lookdir
 
+    # Key of self.lookdir for the gaze point, -1 if the tracker is not connected
+    def look_direction_index(self, tracking_data):
+        if tracking_data[0] != "Tracker connected":
+            return -1
+        if tracking_data[4] < self.screen_width/2 and tracking_data[5] < self.screen_height/2:
+            return 0
+        elif tracking_data[4] > self.screen_width/2 and tracking_data[5] < self.screen_height/2:
+            return 1
+        elif tracking_data[4] < self.screen_width/2 and tracking_data[5] > self.screen_height/2:
+            return 2
+        else:
+            return 3
+
     # Further specifies, where one is looking
     def look_direction_coordinates(self, tracking_data, section_amount):
         if tracking_data[0] == "Tracker connected":
@@ -221,262 +1192,2015 @@ class LookDirection:
             
             return coordinate_x, coordinate_y
 
-class TextManager:
-    def __init__(self):
-        self.canvas = tk.Canvas(root, width=700, height=400) # Creates a canvas inside the window
-        self.canvas.pack()
+    # Value of the first area of interest under the gaze point (or the fallback of the registry)
+    def look_direction_aoi(self, tracking_data):
+        if tracking_data[0] == "Tracker connected" and self.aoi_registry is not None:
+            return self.aoi_registry.hit(tracking_data[4], tracking_data[5])
+
+    # Index of the area in the registry as it is recorded, -1 without an area
+    def look_direction_aoi_index(self, tracking_data):
+        if tracking_data[0] == "Tracker connected" and self.aoi_registry is not None:
+            return self.aoi_registry.hit_index(tracking_data[4], tracking_data[5])
+        return -1
+
+# Rectangle [x0, x1) x [y0, y1) or polygon (even-odd rule) on the virtual desktop. Bounds may be infinite.
+# hit() returns value, which is the name unless something else is given
+class AreaOfInterest:
+    __slots__ = ("name", "value", "bounds", "edges")
+
+    def __init__(self, name, bounds, polygon=None, value=None):
+        self.name = name
+        self.value = name if value is None else value
+        self.bounds = bounds
+        self.edges = None
+        if polygon is not None:
+            self.edges = tuple((float(x0), float(y0), float(x1), float(y1)) for (x0, y0), (x1, y1) in zip(polygon, polygon[1:] + polygon[:1]))
+
+    def contains(self, x, y):
+        x0, y0, x1, y1 = self.bounds
+        if not (x0 <= x < x1 and y0 <= y < y1):
+            return False
+        if self.edges is None:
+            return True
+        inside = False
+        for edge_x0, edge_y0, edge_x1, edge_y1 in self.edges:
+            if (edge_y0 > y) != (edge_y1 > y) and x < edge_x0 + (y - edge_y0) * (edge_x1 - edge_x0) / (edge_y1 - edge_y0):
+                inside = not inside
+        return inside
+
+# Areas of interest with a uniform grid of buckets over the layout: every bucket lists the areas that overlap it, so a hit
+# test only checks the few areas of one bucket however many are registered. Points outside the layout use the nearest
+# bucket. Earlier areas win where areas overlap, points in no area return fallback
+class AOIRegistry:
+    def __init__(self, bucket_size=64, bounds=None, fallback=None):
+        self.bucket_size = bucket_size
+        self.bounds = bounds    # Layout (x0, y0, x1, y1), default: all finite coordinates of monitors and areas
+        self.fallback = fallback
+        self.monitors = {}  # Name -> (x, y, width, height) on the virtual desktop
+        self.aois = []
+        self.buckets = None
+
+    def add_monitor(self, name, x, y, width, height):
+        self.monitors[name] = (x, y, width, height)
+        self.buckets = None
+
+    # Coordinates are relative to the top left corner of monitor, if a monitor is given
+    def add_rect(self, name, x0, y0, x1, y1, monitor=None, value=None):
+        offset_x, offset_y = self.monitors[monitor][:2] if monitor is not None else (0, 0)
+        self.aois.append(AreaOfInterest(name, (x0 + offset_x, y0 + offset_y, x1 + offset_x, y1 + offset_y), value=value))
+        self.buckets = None
+
+    def add_polygon(self, name, points, monitor=None, value=None):
+        offset_x, offset_y = self.monitors[monitor][:2] if monitor is not None else (0, 0)
+        points = [(x + offset_x, y + offset_y) for x, y in points]
+        xs, ys = [x for x, y in points], [y for x, y in points]
+        self.aois.append(AreaOfInterest(name, (min(xs), min(ys), max(xs), max(ys)), points, value))
+        self.buckets = None
+
+    # Fills the buckets, done automatically by the first hit test after a change
+    def build(self):
+        if self.bounds is not None:
+            x0, y0, x1, y1 = self.bounds
+        else:
+            xs = [x for aoi in self.aois for x in aoi.bounds[0::2] if math.isfinite(x)]
+            ys = [y for aoi in self.aois for y in aoi.bounds[1::2] if math.isfinite(y)]
+            for x, y, width, height in self.monitors.values():
+                xs += [x, x + width]
+                ys += [y, y + height]
+            x0, x1 = (min(xs), max(xs)) if xs else (0, 0)
+            y0, y1 = (min(ys), max(ys)) if ys else (0, 0)
+        self.origin = (x0, y0)
+        self.columns = max(math.ceil((x1 - x0) / self.bucket_size), 1)
+        self.rows = max(math.ceil((y1 - y0) / self.bucket_size), 1)
+
+        buckets = [[] for i in range(self.columns * self.rows)]
+        for index, aoi in enumerate(self.aois):
+            first_column, first_row = self.bucket_position(aoi.bounds[0], aoi.bounds[1])
+            last_column, last_row = self.bucket_position(aoi.bounds[2], aoi.bounds[3])
+            for row in range(first_row, last_row+1):
+                for column in range(first_column, last_column+1):
+                    buckets[row*self.columns + column].append(index)
+        self.buckets = [tuple(bucket) for bucket in buckets]
+
+        # The same buckets as flat arrays for hit_batch
+        self.bucket_starts = np.cumsum([0] + [len(bucket) for bucket in buckets])
+        self.bucket_aois = np.array([index for bucket in buckets for index in bucket], dtype=np.int64)
+        self.aoi_bounds = np.array([aoi.bounds for aoi in self.aois], dtype=np.float64).reshape(-1, 4)
+        self.aoi_is_polygon = np.array([aoi.edges is not None for aoi in self.aois], dtype=bool)
+        # Edges of every polygon padded with NaN to the longest one, NaN edges are never crossed
+        edge_count = max([len(aoi.edges) for aoi in self.aois if aoi.edges is not None], default=0)
+        self.aoi_edges = np.full((len(self.aois), edge_count, 4), np.nan)
+        for index, aoi in enumerate(self.aois):
+            if aoi.edges is not None:
+                self.aoi_edges[index, :len(aoi.edges)] = aoi.edges
+
+    def bucket_position(self, x, y):
+        column = min(max((x - self.origin[0]) / self.bucket_size, 0), self.columns - 1)
+        row = min(max((y - self.origin[1]) / self.bucket_size, 0), self.rows - 1)
+        return int(column), int(row)
+
+    # Index of the first area that contains the point, -1 if there is none
+    def hit_index(self, x, y):
+        if self.buckets is None:
+            self.build()
+        column, row = self.bucket_position(x, y)
+        aois = self.aois
+        for index in self.buckets[row*self.columns + column]:
+            if aois[index].contains(x, y):
+                return index
+        return -1
+
+    def hit(self, x, y):
+        index = self.hit_index(x, y)
+        return self.aois[index].value if index >= 0 else self.fallback
+
+    # hit_index for whole arrays, NaN points hit nothing. Every point is paired with the areas of its bucket, the bounds of
+    # all pairs are tested at once and only the pairs inside the bounds of a polygon are tested against its edges
+    def hit_batch(self, x, y):
+        if self.buckets is None:
+            self.build()
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        valid = ~(np.isnan(x) | np.isnan(y))
+        columns = np.clip(np.nan_to_num((x - self.origin[0]) / self.bucket_size), 0, self.columns - 1).astype(np.int64)
+        rows = np.clip(np.nan_to_num((y - self.origin[1]) / self.bucket_size), 0, self.rows - 1).astype(np.int64)
+        bucket_ids = np.where(valid, rows*self.columns + columns, 0)
+
+        counts = np.where(valid, self.bucket_starts[bucket_ids+1] - self.bucket_starts[bucket_ids], 0)
+        pair_points = np.repeat(np.arange(len(x)), counts)
+        pair_positions = np.arange(len(pair_points)) - np.repeat(np.cumsum(counts) - counts - self.bucket_starts[bucket_ids], counts)
+        pair_aois = self.bucket_aois[pair_positions]
+
+        pair_x, pair_y = x[pair_points], y[pair_points]
+        bounds = self.aoi_bounds[pair_aois]
+        inside = (pair_x >= bounds[:, 0]) & (pair_x < bounds[:, 2]) & (pair_y >= bounds[:, 1]) & (pair_y < bounds[:, 3])
+
+        polygon_pairs = np.flatnonzero(inside & self.aoi_is_polygon[pair_aois])
+        if len(polygon_pairs):
+            edges = self.aoi_edges[pair_aois[polygon_pairs]]
+            edge_x0, edge_y0, edge_x1, edge_y1 = edges[:, :, 0], edges[:, :, 1], edges[:, :, 2], edges[:, :, 3]
+            polygon_x, polygon_y = pair_x[polygon_pairs, None], pair_y[polygon_pairs, None]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crossings = ((edge_y0 > polygon_y) != (edge_y1 > polygon_y)) & (polygon_x < edge_x0 + (polygon_y - edge_y0) * (edge_x1 - edge_x0) / (edge_y1 - edge_y0))
+            inside[polygon_pairs] = np.count_nonzero(crossings, axis=1) % 2 == 1
+
+        # The areas of a bucket are in the order they were added, so the first pair inside is the area that wins
+        result = np.full(len(x), -1, dtype=np.int64)
+        points, firsts = np.unique(pair_points[inside], return_index=True)
+        result[points] = pair_aois[inside][firsts]
+        return result
+
+    # Values for the indices of hit_batch, the fallback for -1
+    def values(self, indices):
+        values = [aoi.value for aoi in self.aois] + [self.fallback]
+        return [values[index] for index in indices]
+
+    # Registry from a JSON file: {"bucket_size": 64, "fallback": null, "monitors": [{"name", "x", "y", "width", "height"}],
+    # "aois": [{"name", "rect": [x0, y0, x1, y1]} or {"name", "polygon": [[x, y], ...]}, optionally with "monitor"]}
+    @staticmethod
+    def load(filename):
+        with open(filename) as file:
+            layout = json.load(file)
+        registry = AOIRegistry(layout.get("bucket_size", 64), fallback=layout.get("fallback"))
+        for monitor in layout.get("monitors", []):
+            registry.add_monitor(monitor["name"], monitor["x"], monitor["y"], monitor["width"], monitor["height"])
+        for aoi in layout["aois"]:
+            if "rect" in aoi:
+                registry.add_rect(aoi["name"], *aoi["rect"], monitor=aoi.get("monitor"))
+            else:
+                registry.add_polygon(aoi["name"], [tuple(point) for point in aoi["polygon"]], monitor=aoi.get("monitor"))
+        return registry
+
+    # The quadrants of LookDirection.look_direction_index: "<" and ">" become half-open bounds with math.nextafter,
+    # everything else (including points on the middle lines) falls back to 3 like in the original
+    @staticmethod
+    def quadrants(screen_width, screen_height):
+        middle_x, middle_y = screen_width/2, screen_height/2
+        registry = AOIRegistry(bounds=(0, 0, screen_width, screen_height), fallback=3)
+        registry.add_rect("Looks Left & Looks Up", -math.inf, -math.inf, middle_x, middle_y, value=0)
+        registry.add_rect("Looks Right & Looks Up", math.nextafter(middle_x, math.inf), -math.inf, math.inf, middle_y, value=1)
+        registry.add_rect("Looks Left & Looks Down", -math.inf, math.nextafter(middle_y, math.inf), middle_x, math.inf, value=2)
+        return registry
+
+    # The cells of LookDirection.look_direction_coordinates with (coordinate_x, coordinate_y) as value. The last column and
+    # row reach to infinity like the clamped coordinates, points left of or above the screen are in no cell
+    @staticmethod
+    def grid(screen_width, screen_height, section_amount=16):
+        sections = int(section_amount ** 0.5)
+        section_width, section_height = screen_width / sections, screen_height / sections
+        registry = AOIRegistry(bucket_size=max(min(section_width, section_height), 1), bounds=(0, 0, screen_width, screen_height))
+        for coordinate_y in range(sections):
+            for coordinate_x in range(sections):
+                registry.add_rect(f"({coordinate_x}, {coordinate_y})",
+                    coordinate_x*section_width, coordinate_y*section_height,
+                    (coordinate_x+1)*section_width if coordinate_x < sections-1 else math.inf,
+                    (coordinate_y+1)*section_height if coordinate_y < sections-1 else math.inf,
+                    value=(coordinate_x, coordinate_y))
+        return registry
+
+# Fixation found by FixationDetector, tag and instance_id are the ones the gaze rested on longest during the fixation
+class FixationEvent(collections.namedtuple("FixationEvent", ("start", "duration", "x", "y", "samples", "tag", "instance_id"))):
+    __slots__ = ()
+
+# State of the fixation that is currently running
+class Fixation:
+    __slots__ = ("start", "last", "sum_x", "sum_y", "samples", "min_x", "max_x", "min_y", "max_y", "pending", "run_labels", "run_time", "labels", "labels_time")
+
+    def __init__(self, timestamp, x, y, labels):
+        self.start = self.last = timestamp
+        self.sum_x, self.sum_y = x, y
+        self.samples = 1
+        self.min_x = self.max_x = x
+        self.min_y = self.max_y = y
+        self.pending = []   # Dwell that is only counted once the fixation has reached the minimum duration
+        self.run_labels, self.run_time = labels, 0.0
+        self.labels, self.labels_time = labels, 0.0
+
+# Streaming fixation detection on the corrected gaze with constant work per sample. "ivt" ends a fixation when the gaze
+# moves faster than velocity_threshold (px/s), "idt" when the fixation would get wider than dispersion_threshold
+# (x range + y range in px). The time of every fixation sample is added to the dwell of its tag and instance id
+class FixationDetector:
+    def __init__(self, method="ivt", velocity_threshold=1000, dispersion_threshold=150, min_duration=0.1, max_events=65536):
+        if method not in ("ivt", "idt"):
+            raise ValueError(f"Unknown fixation detection method {method}")
+        self.method = method
+        self.velocity_threshold = velocity_threshold
+        self.dispersion_threshold = dispersion_threshold
+        self.min_duration = min_duration
+
+        # Dwell in seconds, tags by their index in SEMANTIC_TAGS (no result and unknown tags in the last two entries),
+        # instances by green << 8 | blue
+        self.tag_dwell = np.zeros(256)
+        self.instance_dwell = np.zeros(65536)
+
+        self.events = collections.deque(maxlen=max_events)  # Newest fixations for live queries
+        self.fixation_count = 0
+        self.fixation_time = 0.0
+        self.fixation = None
+        self.previous = None    # Timestamp and position of the last sample
+        self.result = None
+        self.labels = (-1, -1)
+
+    # Tag index and instance key of a segmentation result, only parsed when a new result arrives
+    def result_labels(self, segmentation_result):
+        if segmentation_result is not self.result:
+            self.result = segmentation_result
+            instance = -1
+            if segmentation_result is not None and segmentation_result.instance_id != "Null":
+                g, b = segmentation_result.instance_id.split("-")
+                instance = int(g) << 8 | int(b)
+            self.labels = (TAG_TO_INDEX.get(segmentation_result.tag, -2) if segmentation_result is not None else -1, instance)
+        return self.labels
+
+    # Returns the FixationEvent that this sample has ended, otherwise None
+    def add_sample(self, sample, segmentation_result=None):
+        if not sample.connected or sample.tracking_data[1]:
+            self.previous = None
+            return self.end_fixation()
+
+        timestamp, x, y = sample.timestamp, sample.x, sample.y
+        labels = self.result_labels(segmentation_result)
+        fixation = self.fixation
+        event = None
+
+        if fixation is None:
+            self.fixation = Fixation(timestamp, x, y, labels)
+        else:
+            if self.method == "ivt":
+                previous_timestamp, previous_x, previous_y = self.previous
+                duration = timestamp - previous_timestamp
+                moved = duration > 0 and math.hypot(x - previous_x, y - previous_y) > self.velocity_threshold*duration
+            else:
+                moved = max(fixation.max_x, x) - min(fixation.min_x, x) + max(fixation.max_y, y) - min(fixation.min_y, y) > self.dispersion_threshold
 
-    # Creates text output to be displayed on the canvas inside the window
-    def update_text(self, tracking_data, look_direction_rough, coordinates):
-        if tracking_data[0] == "Tracker connected":
-            self.text_content = [
-                "Beam Eye-Tracker connection state: " + tracking_data[0],
-                "Screen Gaze lost state: " + str(tracking_data[1]),
-                "Confidence: " + str(tracking_data[2]),
-                "Coordinates: x = " + str(tracking_data[4]) + " px & y = " + str(tracking_data[5]) + " px",
-                "Confidence color: " + tracking_data[3],
-                "Looking direction: " + look_direction_rough,
-                "Screen quadrant: " + str(coordinates),
-                "Tag: " + tag,
-                "Instance ID: " + instance_id
-            ]
+            if moved:
+                event = self.end_fixation()
+                self.fixation = Fixation(timestamp, x, y, labels)
+            else:
+                self.extend_fixation(fixation, timestamp, x, y, labels)
+
+        self.previous = (timestamp, x, y)
+        return event
+
+    def extend_fixation(self, fixation, timestamp, x, y, labels):
+        dwell = timestamp - fixation.last
+        fixation.last = timestamp
+        fixation.sum_x += x
+        fixation.sum_y += y
+        fixation.samples += 1
+        fixation.min_x, fixation.max_x = min(fixation.min_x, x), max(fixation.max_x, x)
+        fixation.min_y, fixation.max_y = min(fixation.min_y, y), max(fixation.max_y, y)
+
+        if fixation.pending is None:
+            self.add_dwell(labels, dwell)
         else:
-            self.text_content = ["Tracker not connected"]
-            
-        self.canvas.delete("all")
+            fixation.pending.append((labels, dwell))
+            if timestamp - fixation.start >= self.min_duration:
+                for pending_labels, pending_dwell in fixation.pending:
+                    self.add_dwell(pending_labels, pending_dwell)
+                fixation.pending = None
+
+        # The labels of the longest uninterrupted stretch describe the fixation
+        if labels == fixation.run_labels:
+            fixation.run_time += dwell
+        else:
+            fixation.run_labels, fixation.run_time = labels, dwell
+        if fixation.run_time > fixation.labels_time:
+            fixation.labels, fixation.labels_time = fixation.run_labels, fixation.run_time
+
+    def add_dwell(self, labels, dwell):
+        tag, instance = labels
+        self.tag_dwell[tag] += dwell
+        if instance >= 0:
+            self.instance_dwell[instance] += dwell
+
+    # Ends the running fixation, returns it as FixationEvent if it lasted at least min_duration
+    def end_fixation(self):
+        fixation = self.fixation
+        self.fixation = None
+        if fixation is None or fixation.pending is not None:
+            return None
+
+        tag, instance = fixation.labels
+        event = FixationEvent(
+            fixation.start,
+            fixation.last - fixation.start,
+            fixation.sum_x / fixation.samples,
+            fixation.sum_y / fixation.samples,
+            fixation.samples,
+            SEMANTIC_TAGS[tag] if tag >= 0 else ("Null" if tag == -1 else "Unknown"),
+            f"{instance >> 8}-{instance & 255}" if instance >= 0 else "Null"
+        )
+        self.events.append(event)
+        self.fixation_count += 1
+        self.fixation_time += event.duration
+        return event
+
+    # Dwell in seconds of every tag that was looked at
+    def dwell_by_tag(self):
+        dwell = {tag: float(self.tag_dwell[i]) for i, tag in enumerate(SEMANTIC_TAGS) if self.tag_dwell[i] > 0}
+        if self.tag_dwell[-2] > 0:
+            dwell["Unknown"] = float(self.tag_dwell[-2])
+        if self.tag_dwell[-1] > 0:
+            dwell["Null"] = float(self.tag_dwell[-1])
+        return dwell
+
+    # The count instance ids with the longest dwell, longest first
+    def dwell_by_instance(self, count=10):
+        count = min(count, np.count_nonzero(self.instance_dwell))
+        if count == 0:
+            return []
+        keys = np.argpartition(self.instance_dwell, -count)[-count:]
+        keys = keys[np.argsort(self.instance_dwell[keys])[::-1]]
+        return [(f"{key >> 8}-{key & 255}", float(self.instance_dwell[key])) for key in keys]
+
+    # Writes the fixations to Fixations_<timestamp>.csv and the dwell per tag and instance to Dwell_<timestamp>.json
+    def write(self, timestamp=None):
+        self.end_fixation()
+        if timestamp is None:
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+        with open(f"Fixations_{timestamp}.csv", mode="w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Start", "Duration", "x", "y", "Samples", "Tag", "Instance ID"])
+            writer.writerows(self.events)
+        with open(f"Dwell_{timestamp}.json", mode="w") as file:
+            json.dump({
+                "method": self.method,
+                "fixations": self.fixation_count,
+                "fixation time": self.fixation_time,
+                "tags": self.dwell_by_tag(),
+                "instances": dict(self.dwell_by_instance(int(np.count_nonzero(self.instance_dwell))))
+            }, file, indent=4)
+
+# Attention map of the gaze in a preallocated histogram of bin_size x bin_size pixel bins, next to the hit counts of
+# the LookDirection grid. With a half-life older hits fade out: instead of scaling the whole map on every sample, new
+# hits get a growing weight and the map is only rescaled when the weight gets too large
+class AttentionMap:
+    def __init__(self, screen_width, screen_height, bin_size=20, half_life=None, section_amount=16):
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.bin_size = bin_size
+        self.half_life = half_life  # Seconds, None keeps all hits at full weight
+        self.histogram = np.zeros((math.ceil(screen_height / bin_size), math.ceil(screen_width / bin_size)))
+
+        # Same cells as LookDirection.look_direction_coordinates
+        self.sections = int(section_amount ** 0.5)
+        self.section_width = screen_width / self.sections
+        self.section_height = screen_height / self.sections
+        self.grid = np.zeros((self.sections, self.sections))
+
+        self.samples = 0
+        self.outside = 0    # Gaze points that were not on the screen
+        self.reference_time = None  # Time at which a hit has the weight 1
+        self.last_time = None
+
+    # Adds one gaze point, coordinates are the grid cell from look_direction_coordinates if it is already known
+    def add(self, x, y, timestamp, coordinates=None):
+        if not (0 <= x < self.screen_width and 0 <= y < self.screen_height):
+            self.outside += 1
+            return
+
+        weight = 1.0
+        if self.half_life is not None:
+            if self.reference_time is None:
+                self.reference_time = timestamp
+            weight = 2.0 ** ((timestamp - self.reference_time) / self.half_life)
+            if weight > 1e100:
+                self.rescale(timestamp)
+                weight = 1.0
+        self.last_time = timestamp
+
+        self.histogram[int(y // self.bin_size), int(x // self.bin_size)] += weight
+        if coordinates is None:
+            coordinates = (min(int(x // self.section_width), self.sections-1), min(int(y // self.section_height), self.sections-1))
+        self.grid[coordinates[1], coordinates[0]] += weight
+        self.samples += 1
+
+    # Lost samples hold the last position, they are skipped like in FixationDetector
+    def add_sample(self, sample, coordinates=None):
+        if sample.connected and not sample.tracking_data[1]:
+            self.add(sample.x, sample.y, sample.timestamp, coordinates)
+
+    # Moves the reference time to timestamp, so the stored hits become the decayed values at that time
+    def rescale(self, timestamp):
+        factor = 2.0 ** (-(timestamp - self.reference_time) / self.half_life)
+        self.histogram *= factor
+        self.grid *= factor
+        self.reference_time = timestamp
+
+    # Decay factor from the stored values to the values at timestamp (default: the last hit)
+    def decay(self, timestamp=None):
+        if self.half_life is None or self.reference_time is None:
+            return 1.0
+        if timestamp is None:
+            timestamp = self.last_time
+        return 2.0 ** (-(timestamp - self.reference_time) / self.half_life)
+
+    # Weighted hits per bin, rows are y
+    def values(self, timestamp=None):
+        return self.histogram * self.decay(timestamp)
+
+    # Weighted hits per LookDirection cell, indexed [coordinate_y, coordinate_x]
+    def grid_values(self, timestamp=None):
+        return self.grid * self.decay(timestamp)
+
+    # Map scaled to 0..255, the bin with the most hits is 255
+    def image(self, timestamp=None):
+        values = self.values(timestamp)
+        peak = values.max()
+        if peak <= 0:
+            return np.zeros(values.shape, dtype=np.uint8)
+        return np.round(values / peak * 255).astype(np.uint8)
+
+    # Writes the map as .npy array, as colored image with OpenCV or, without OpenCV, as grayscale .pgm. Returns the file name
+    def save(self, filename, timestamp=None):
+        if filename.endswith(".npy"):
+            np.save(filename, self.values(timestamp))
+            return filename
+
+        image = self.image(timestamp)
+        if cv2 is not None:
+            cv2.imwrite(filename, cv2.applyColorMap(image, cv2.COLORMAP_JET))
+            return filename
+
+        filename = os.path.splitext(filename)[0] + ".pgm"
+        with open(filename, mode="wb") as file:
+            file.write(f"P5 {image.shape[1]} {image.shape[0]} 255\n".encode())
+            file.write(image.tobytes())
+        return filename
+
+class TextManager:
+    # Text of every line, the values of the line are filled in with str()
+    line_templates = (
+        "Beam Eye-Tracker connection state: {}",
+        "Screen Gaze lost state: {}",
+        "Confidence: {}",
+        "Coordinates: x = {} px & y = {} px",
+        "Confidence color: {}",
+        "Looking direction: {}",
+        "Screen quadrant: {}",
+        "Tag: {}",
+        "Instance ID: {}"
+    )
 
-        # Adds a text line based on self.text_content
-        y_position = 20  # Text starting location inside canvas
-        for line in self.text_content:
-            self.canvas.create_text(350, y_position, text=line, font=("Helvetica", 16), fill="black")
+    def __init__(self, refresh_rate=10, canvas=None, origin=(0, 0), latency_monitor=None, show_aoi=False):
+        # Draws on a canvas of its own, or on a shared one with the panel's top left corner at origin
+        if canvas is None:
+            canvas = tk.Canvas(root, width=700, height=400) # Creates a canvas inside the window
+            canvas.pack()
+        self.canvas = canvas
+        self.origin_x, self.origin_y = origin
+
+        self.refresh_interval = 1/refresh_rate  # The text is refreshed at most this often, independent of the gaze rate
+        self.next_refresh = 0.0
+
+        # All canvas items are created once, afterwards only the changed ones are configured
+        x_position = self.origin_x + 350
+        y_position = self.origin_y + 20  # Text starting location inside canvas
+        # The area of interest is only shown if areas are defined
+        self.show_aoi = show_aoi
+        self.templates = TextManager.line_templates + (("Area of interest: {}",) if show_aoi else ())
+        self.lines = []
+        for i in range(len(self.templates)):
+            self.lines.append(self.canvas.create_text(x_position, y_position, text="", font=("Helvetica", 16), fill="black"))
             y_position += 30  # Line spacing
-        
-        self.canvas.create_text(350, y_position+30, text="Confidence:", font=("Helvetica", 16), fill="black")
-        self.canvas.create_oval(325, y_position+40, 375, y_position+90, fill=tracking_data[3])
+        self.line_values = [None] * len(self.lines)
+
+        self.confidence_text = self.canvas.create_text(x_position, y_position+30, text="Confidence:", font=("Helvetica", 16), fill="black")
+        self.confidence_oval = self.canvas.create_oval(x_position-25, y_position+40, x_position+25, y_position+90, fill="#D9D9D9")
+        self.confidence_color = "#D9D9D9"
+        self.connected = True
+
+        # Percentiles of the latency monitor below the panel, computed only once per second
+        self.latency_monitor = latency_monitor
+        self.latency_interval = 1.0
+        self.next_latency_refresh = 0.0
+        if latency_monitor is not None:
+            self.latency_text = self.canvas.create_text(x_position, y_position+110, text="", font=("Helvetica", 11), fill="black", anchor="n")
+
+    # Moves the confidence output below the last text line that is shown
+    def place_confidence(self, line_count):
+        x_position = self.origin_x + 350
+        y_position = self.origin_y + 20 + 30*line_count
+        self.canvas.coords(self.confidence_text, x_position, y_position+30)
+        self.canvas.coords(self.confidence_oval, x_position-25, y_position+40, x_position+25, y_position+90)
+
+    # Updates the text output on the canvas, only lines whose values have changed are configured
+    def update_text(self, tracking_data, look_direction_rough, coordinates, segmentation_result, area_of_interest=None):
+        now = time.perf_counter()
+        if now < self.next_refresh:
+            return
+        self.next_refresh = now + self.refresh_interval
+
+        connected = tracking_data[0] == "Tracker connected"
+        if connected:
+            values = (
+                (tracking_data[0],),
+                (tracking_data[1],),
+                (tracking_data[2],),
+                (tracking_data[4], tracking_data[5]),
+                (tracking_data[3],),
+                (look_direction_rough,),
+                (coordinates,),
+                (segmentation_result.tag,),
+                (segmentation_result.instance_id,)
+            )
+            if self.show_aoi:
+                values += ((area_of_interest,),)
+        else:
+            values = ((),) + ((None,),) * (len(self.lines) - 1)
+
+        if connected != self.connected:
+            self.connected = connected
+            self.place_confidence(len(self.lines) if connected else 1)
+
+        for i, value in enumerate(values):
+            if value != self.line_values[i]:
+                self.line_values[i] = value
+                if not connected:
+                    text = "Tracker not connected" if i == 0 else ""
+                else:
+                    text = self.templates[i].format(*(str(item) for item in value))
+                self.canvas.itemconfigure(self.lines[i], text=text)
+
+        # The oval only changes its color when the confidence changes
+        color = tracking_data[3] if connected else "#D9D9D9"
+        if color != self.confidence_color:
+            self.confidence_color = color
+            self.canvas.itemconfigure(self.confidence_oval, fill=color)
+
+        if self.latency_monitor is not None and now >= self.next_latency_refresh:
+            self.next_latency_refresh = now + self.latency_interval
+            self.canvas.itemconfigure(self.latency_text, text="\n".join(self.latency_monitor.summary()))
+
+# Draws the gaze marker and an optional fading trail of the last samples as canvas items that are only moved.
+# The display loop calls draw() at most once per tick, so the redraws are limited by its scheduler
+class GazeOverlay:
+    def __init__(self, canvas, size=50, trail_length=0, confidence_colors=False):
+        self.canvas = canvas
+        self.size = size
+        self.confidence_colors = confidence_colors  # Fills the marker with the confidence color instead of black
+
+        # Trail items from the oldest to the newest sample, fading from the background color to dark gray
+        self.trail = []
+        self.trail_positions = collections.deque(maxlen=trail_length)
+        self.shown_trail = 0
+        for i in range(trail_length):
+            shade = 0xD9 - round(0xD9 * (i+1) / (trail_length+1) * 0.7)
+            color = f"#{shade:02X}{shade:02X}{shade:02X}"
+            self.trail.append(self.canvas.create_oval(0, 0, 0, 0, fill=color, outline="", state="hidden"))
+
+        self.marker = self.canvas.create_rectangle(0, 0, size, size, fill="black", outline="", state="hidden")
+        self.position = None
+        self.color = "black"
+        self.redraws = 0
+
+    # Moves the marker to the gaze point, returns False if nothing had to be redrawn
+    def draw(self, tracking_data):
+        if tracking_data[0] != "Tracker connected":
+            if self.position is not None:
+                self.position = None
+                self.canvas.itemconfigure(self.marker, state="hidden")
+                for item in self.trail:
+                    self.canvas.itemconfigure(item, state="hidden")
+                self.trail_positions.clear()
+                self.shown_trail = 0
+            return False
+
+        x, y = tracking_data[4], tracking_data[5]
+        color = tracking_data[3] if self.confidence_colors else "black"
+
+        # Movements of less than a pixel are not drawn
+        if self.position is not None and abs(x - self.position[0]) < 1 and abs(y - self.position[1]) < 1 and color == self.color:
+            return False
+
+        if self.position is None:
+            self.canvas.itemconfigure(self.marker, state="normal")
+        elif self.trail:
+            self.trail_positions.append(self.position)
+            radius = self.size/4
+            first = len(self.trail) - len(self.trail_positions)
+            for item, (trail_x, trail_y) in zip(self.trail[first:], self.trail_positions):
+                self.canvas.coords(item, trail_x-radius, trail_y-radius, trail_x+radius, trail_y+radius)
+            if len(self.trail_positions) > self.shown_trail:
+                self.shown_trail = len(self.trail_positions)
+                self.canvas.itemconfigure(self.trail[first], state="normal")
+
+        self.position = (x, y)
+        self.canvas.coords(self.marker, x-self.size/2, y-self.size/2, x+self.size/2, y+self.size/2)
+        if color != self.color:
+            self.color = color
+            self.canvas.itemconfigure(self.marker, fill=color)
+        self.redraws += 1
+        return True
 
 class CarlaClient:
-    def __init__(self):
-        pass
-
-    def connect_to_server(self,server_address):
-        # Connect to server
-        client = carla.Client(server_address, 2000)
-        self.world = client.get_world()
-        self.spawn_points = self.world.get_map().get_spawn_points()
-
-    def example_situation(self):
-        # Delete all sensors
-        all_sensor_actors = self.world.get_actors().filter('sensor.*')
-
-        for sensor in all_sensor_actors:
-            sensor.destroy()
-        
-        # Delete all vehicles
-        all_vehicle_actors = self.world.get_actors().filter('vehicle.*')
-
-        for vehicle in all_vehicle_actors:
-            vehicle.destroy()
-
-        # Spawn vehicles
-        vehicle_bp = self.world.get_blueprint_library().filter("vehicle.mercedes.sprinter")
-        start_point = self.spawn_points[0]
-        vehicle = self.world.try_spawn_actor(vehicle_bp[0], start_point)
-
-        # Add camera sensor instace segmentation
-        CAMERA_POS_Z=3.5
-        CAMERA_POS_X=2.5
-
-        user32 = ctypes.windll.user32
-        # Resolution of Instance Segmentation Sensor Image Output is reduced by factor 10 to save performance
-        screen_size_x_scaled = user32.GetSystemMetrics(0)/10
-        screen_size_y_scaled = user32.GetSystemMetrics(1)/10
-
-        camera_bp = self.world.get_blueprint_library().find('sensor.camera.instance_segmentation')
-        camera_bp.set_attribute('image_size_x', str(screen_size_x_scaled))
-        camera_bp.set_attribute('image_size_y', str(screen_size_y_scaled))
-        camera_bp.set_attribute('sensor_tick', '0.02')
-        camera_bp.set_attribute('fov', '80')
-
-        transform = carla.Transform(carla.Location(x=1.1, y=-0.5, z=5.8))
-        sensor = self.world.try_spawn_actor(camera_bp, transform, attach_to = vehicle)
-
-
-        camera_rgb = self.world.get_blueprint_library().find('sensor.camera.rgb')
-        camera_rgb.set_attribute('image_size_x', str(user32.GetSystemMetrics(0)))
-        camera_rgb.set_attribute('image_size_y', str(user32.GetSystemMetrics(1)))
-        camera_rgb.set_attribute('sensor_tick', '0.02')
-        camera_rgb.set_attribute('fov', '80')
-
-        transform_rgb = carla.Transform(carla.Location(x=1.1, y=-0.5, z=2.8))
-        sensor_rgb = self.world.try_spawn_actor(camera_rgb, transform_rgb, attach_to = vehicle)  
-
-        vehicle.set_autopilot(True)
-
-        return sensor, sensor_rgb
-        
-    def process_segmentation_image(self, image, tracking_data): # Read out the instance based on looking coordinate
-         if tracking_data[0] == "Tracker connected":
+    def __init__(self, frame_display=None, show_segmentation=True, show_rgb=True, lookup_size=1, vote_radius=0, confidence_scaled_radius=False, simulator=None, screen_size=None, segmentation_scale=10):
+        self.simulator = simulator if simulator is not None else CarlaSimulator()
+        self.screen_size = screen_size  # Needed for the camera resolutions, queried when the cameras are spawned if not given
+        self.segmentation_scale = segmentation_scale    # Screen pixels per segmentation pixel, higher values save simulator load
+        self.lookup_size = lookup_size  # Side length of the pixel neighbourhood around the gaze point that is read out
+        self.vote_radius = vote_radius  # Radius in screen pixels for the majority vote, 0 reads only the pixel(s) under the gaze point
+
+        # Less reliable gaze points are voted over a larger area
+        self.confidence_scaled_radius = confidence_scaled_radius
+        self.radius_scale = {
+            TrackingConfidence.HIGH: 1,
+            TrackingConfidence.MEDIUM: 1.5,
+            TrackingConfidence.LOW: 2,
+            TrackingConfidence.UNRELIABLE: 3
+        }
+        self.disk_masks = {}    # Radius -> boolean mask of the pixels within the radius
 
-            global tag
-            global instance_id
+        # Segmentation frames can be recorded for the replay, the file is created when the first frame shows the size
+        self.record_frames = False
+        self.frame_recorder = None
+        self.latency_monitor = None     # Records handoff and lookup time of every frame if set
+        self.profiler = None
+        self.gaze_join = None   # GazeFrameJoin that picks the gaze sample of the moment the frame shows
+        # Camera images are only handed to the display thread, without a display nothing is rendered
+        self.segmentation_window = frame_display.add_window("Kameraausgabe") if frame_display is not None and show_segmentation else None
+        self.rgb_window = frame_display.add_window("Kameraausgabe_rgb") if frame_display is not None and show_rgb else None
 
-            x = tracking_data[4]
-            y = tracking_data[5]
+        # Newest result of the segmentation callback, read by the main loop without a lock
+        self.latest_result = LatestSample(SegmentationResult("Null", "Null", 0.0, None, 0.0, 0.0))
 
-            x_scaled = x/10
-            x_scaled = math.ceil(x_scaled)
-            y_scaled = y/10
-            y_scaled = math.ceil(y_scaled)
+    def connect_to_server(self,server_address):
+        self.simulator.connect(server_address)
 
-            
-            array = np.frombuffer(image.raw_data, dtype=np.uint8)
-            array = np.reshape(array, (image.height, image.width, 4)) 
-            
+    def example_situation(self):
+        if self.screen_size is None:
+            self.screen_size = Win32DisplayMetrics().screen_size()
+        screen_width, screen_height = self.screen_size
+
+        # Resolution of Instance Segmentation Sensor Image Output is reduced by segmentation_scale to save performance
+        segmentation_size = (max(round(screen_width/self.segmentation_scale), 1), max(round(screen_height/self.segmentation_scale), 1))
+        rgb_size = (screen_width, screen_height) if self.rgb_window is not None else None
+        return self.simulator.example_situation(segmentation_size, rgb_size)
+
+    # arrival is the time.perf_counter() time the frame was received, given by the replay
+    def process_segmentation_image(self, image, sample, arrival=None): # Read out the instance based on looking coordinate
+         profiler = self.profiler
+         if profiler is not None:
+            wall_start, cpu_start = time.perf_counter(), time.thread_time()
+
+         # Without a join the frame is combined with the sample that happens to be the newest when the callback runs
+         skew = None
+         gaze_join = self.gaze_join
+         if gaze_join is not None:
+            joined, skew = gaze_join.join(image, time.perf_counter() if arrival is None else arrival)
+            if joined is not None:
+                sample = joined
+
+         if self.segmentation_window is not None:
+            self.segmentation_window.publish(image)
+         if self.record_frames:
+            self.record_frame(image)
+
+         # The sample is immutable, so x, y and timestamp always belong together even while the acquisition thread publishes new ones
+         if sample.connected:
+            latency = self.latency_monitor
+            if latency is not None:
+                lookup_start = time.perf_counter()
+                latency.record("handoff", lookup_start - sample.timestamp)
+
+            # The mapping follows the size of the frame itself, so it stays right whatever resolution the camera delivers
+            if self.screen_size is not None:
+                scale_x = image.width / self.screen_size[0]
+                scale_y = image.height / self.screen_size[1]
+            else:
+                scale_x = scale_y = 1 / self.segmentation_scale
+            column = min(max(int(sample.x * scale_x), 0), image.width-1)
+            row = min(max(int(sample.y * scale_y), 0), image.height-1)
 
-            cv2.imshow("Kameraausgabe", array)
-            cv2.waitKey(1)  
-
-            b, g, r, a = array[y_scaled-1, x_scaled-1, 0], array[y_scaled-1, x_scaled-1, 1], array[y_scaled-1, x_scaled-1, 2], array[y_scaled-1, x_scaled-1, 3] # for BGRA image 
-
-            red_to_tag_mapping = {
-                0: "Unlabeled",
-                1: "Roads",
-                2: "SideWalks",
-                3: "Building",
-                4: "Wall",
-                5: "Fence",
-                6: "Pole",
-                7: "TrafficLight",
-                8: "TrafficSign",
-                9: "Vegetation",
-                10: "Terrain",
-                11: "Sky",
-                12: "Pedestrian",
-                13: "Rider",
-                14: "Car",
-                15: "Truck",
-                16: "Bus",
-                17: "Train",
-                18: "Motorcycle",
-                19: "Bicycle",
-                20: "Static",
-                21: "Dynamic",
-                22: "Other", 
-                23: "Water",
-                24: "RoadLine",
-                25: "Ground",
-                26: "Bridge",
-                27: "RailTrack",
-                28: "GuardRail"
-            }
+            radius = self.vote_radius
+            if self.confidence_scaled_radius:
+                radius *= self.radius_scale.get(sample.tracking_data[2], 3)
+            radius = round(radius * scale_x)
 
-            tag = red_to_tag_mapping.get(r, "Unknown")  
-            instance_id = str(g) + "-" + str(b)
+            if radius > 0:
+                tag, instance_id, score = self.vote_instance(image, column, row, radius)
+            else:
+                tag, instance_id = CarlaClient.lookup_instance(image, column, row, self.lookup_size)
+                score = 1.0
+
+            timestamp = time.perf_counter()
+            self.latest_result.publish(SegmentationResult(tag, instance_id, sample.timestamp, image.frame, timestamp, score, skew))
+            if latency is not None:
+                latency.record("lookup", timestamp - lookup_start)
+                latency.record("gaze to label", timestamp - sample.timestamp)
+
+         if profiler is not None:
+            profiler.record("segmentation callback", wall_start, cpu_start)
+
+    # Appends the frame to a recording that ReplayEngine can read
+    def record_frame(self, image):
+        if self.frame_recorder is None:
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            self.frame_recorder = BinaryRecording(f"Segmentation_Frames_{timestamp}.eyerec", segmentation_frame_dtype(image.width, image.height), {"width": image.width, "height": image.height}, chunk_size=16)
+        pixels = np.frombuffer(image.raw_data, dtype=np.uint8).reshape(image.height, image.width, 4)
+        self.frame_recorder.append((time.perf_counter(), image.frame, image.timestamp, pixels))
+
+    # Reads tag and instance id straight from the BGRA bytes of the image without converting the whole frame
+    @staticmethod
+    def lookup_instance(image, column, row, size=1):
+        raw_data = image.raw_data
+        width = image.width
+        column = min(max(column, 0), width-1)
+        row = min(max(row, 0), image.height-1)
+
+        if size == 1:
+            offset = (row*width + column)*4
+            b, g, r = raw_data[offset], raw_data[offset+1], raw_data[offset+2]
+            return RED_TO_TAG[r], f"{g}-{b}"
+
+        # The pixel that occurs most often in the size x size neighbourhood wins
+        counts = {}
+        first_column = max(column - size//2, 0)
+        last_column = min(column - size//2 + size, width)
+        for pixel_row in range(max(row - size//2, 0), min(row - size//2 + size, image.height)):
+            pixels = raw_data[(pixel_row*width + first_column)*4:(pixel_row*width + last_column)*4]
+            for i in range(0, len(pixels), 4):
+                key = (pixels[i+2], pixels[i+1], pixels[i])
+                counts[key] = counts.get(key, 0) + 1
+        r, g, b = max(counts, key=counts.get)
+        return RED_TO_TAG[r], f"{g}-{b}"
+
+    # Majority vote over all pixels within the radius (in image pixels) around the gaze point. The instance id is the
+    # most frequent one among the pixels of the winning tag, the score is the share of the pixels that carry the tag
+    def vote_instance(self, image, column, row, radius):
+        mask = self.disk_masks.get(radius)
+        if mask is None:
+            offsets = np.arange(-radius, radius+1)
+            mask = offsets[:, None]**2 + offsets[None, :]**2 <= radius**2
+            self.disk_masks[radius] = mask
+
+        column = min(max(column, 0), image.width-1)
+        row = min(max(row, 0), image.height-1)
+        top, left = max(row-radius, 0), max(column-radius, 0)
+        array = np.frombuffer(image.raw_data, dtype=np.uint8).reshape(image.height, image.width, 4)    # View, nothing is copied
+        patch = array[top:row+radius+1, left:column+radius+1]
+        patch_mask = mask[top-(row-radius):top-(row-radius)+patch.shape[0], left-(column-radius):left-(column-radius)+patch.shape[1]]
+
+        red = patch[:, :, 2][patch_mask]
+        tag_counts = np.bincount(red, minlength=256)
+        red_value = int(tag_counts.argmax())
+
+        instance_keys = ((patch[:, :, 1].astype(np.uint16) << 8) | patch[:, :, 0])[patch_mask][red == red_value]
+        keys, counts = np.unique(instance_keys, return_counts=True)
+        instance_key = int(keys[counts.argmax()])
+
+        return RED_TO_TAG[red_value], f"{instance_key >> 8}-{instance_key & 255}", float(tag_counts[red_value]/red.size)
 
     # This Method is for showing the rgb image
     def process_rgb_image(self, image):
-        array = np.frombuffer(image.raw_data, dtype=np.uint8)
-        array = np.reshape(array, (image.height, image.width, 4)) 
- 
-        cv2.imshow("Kameraausgabe_rgb", array)
-        cv2.waitKey(1)  
+        if self.rgb_window is not None:
+            self.rgb_window.publish(image)
 
 class csv_Logger:
-    def __init__(self):
+    def __init__(self, batch_size=256, flush_interval=1.0, buffer_size=65536):
         timestamp = time.strftime("%Y%m%d_%H%M%S")
         self.filename = f"Eye_Track_Log_{timestamp}.csv"
 
-        with open(self.filename, mode="w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["Cursor x", "Cursor y", "Beam Eye Pos. x", "Beam Eye Pos. y", "Adjusted x", "Adjusted y"])
+        self.batch_size = batch_size    # Rows that trigger a write of the buffer
+        self.flush_interval = flush_interval    # Seconds after which a partly filled buffer is written anyway
+        self.dropped_rows = 0
 
-    def log_data(self, data):
-        with open(self.filename, mode="a", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(data)
-
-# Define inital value basic variables
-tag = "Null"
-instance_id = "Null"
-tracking_data = "Null", "Null", "Null", "Null", "Null", "Null"
-section_amount = 16
-
-# Runs calibration and returns pixel of the buttons and the tracker values
-#calibration = Calibration()
-#calibration_txt = calibration.calibration()
-
-# Logging
-logger = csv_Logger()
-
-# Window to show canvas and black marker for eye position
-user32 = ctypes.windll.user32
-screen_width = user32.GetSystemMetrics(0)
-screen_height = user32.GetSystemMetrics(1)
-root = tk.Tk()
-root.title("Eye Tracker")
-root.geometry(f"{screen_width}x{screen_height}+0+0")
-root.attributes('-alpha', 0.3)
-marker = tk.Button(None, 
-    text="", 
-    font=("Helvetica", 11, "bold"), 
-    bg="black", 
-    fg="white", 
-    activebackground="green", 
-    activeforeground="white", 
-    )
+        # The file stays open for the whole session, rows are written in batches by the writer thread
+        self.file = open(self.filename, mode="w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["Cursor x", "Cursor y", "Beam Eye Pos. x", "Beam Eye Pos. y", "Adjusted x", "Adjusted y"])
+        self.file.flush()
 
-# Determine refresh rate of Eye Tracker readout
-start_time = time.time()
-frame_interval = 1/30 # 30 Hz refresh rate
+        self.buffer = collections.deque(maxlen=buffer_size) # Ring buffer, the oldest rows are dropped if the writer falls behind
+        self.condition = threading.Condition()
+        self.closed = False
+        self.profiler = None
 
-# Start required classes
-eye_tracker = EyeTracker()
-look_direction = LookDirection()
-text_manager = TextManager()
-carla_client = CarlaClient()
-correct_curvature = CorrectCurvature()
+        self.thread = threading.Thread(target=self.write_loop, name="csv_Logger", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)  # Writes the remaining rows if the program ends without calling close()
 
-# Start CARLA simulation as client
-carla_client.connect_to_server("localhost")
-sensor = carla_client.example_situation()
-# Callback function to acquire instances of the segmentation
-sensor[0].listen(lambda image: carla_client.process_segmentation_image(image, tracking_data))
-
-# Callback function to acquire instances of the segmentation
-sensor[1].listen(lambda image: carla_client.process_rgb_image(image))
-
-while True:
-    current_time = time.time()
-    if current_time - start_time >= frame_interval:
-        start_time = current_time
-
-        x_cur, y_cur = pyautogui.position() # Reads out cursor position -> Use it to know where you looked
-
-        tracking_data_unadjusted = eye_tracker.get_trackingdata()
-        x_1 = tracking_data_unadjusted[4]
-        y_1 = tracking_data_unadjusted[5]
-
-        # Calibration & Curvature Correction
-        tracking_data_adjusted = correct_curvature.correct(tracking_data_unadjusted)
-        #tracking_data_cal_adjusted = calibration.add_offset(tracking_data_adjusted) # Calibration is deactivated since curvature correction works better
-
-        # For testing the original calibration is not done anymore. Only curvature calibration is done.
-        # If calibration needs to be implemented again the curvature correction also needs to applied in line 96 where the calibration takes place.
-        # Curvature Correciton must be done before screen calibration!!
-        
-        tracking_data = tracking_data_adjusted
-        x_2 = tracking_data[4]
-        y_2 = tracking_data[5]
-
-        look_dir= look_direction.look_direction_rough(tracking_data)
-        look_coord = look_direction.look_direction_coordinates(tracking_data, section_amount)
-        text_manager.update_text(tracking_data, look_dir, look_coord)
-
-        marker.place(x=tracking_data[4]-50/2, y=tracking_data[5]-50/2, width=50, height=50)
-        tk.Misc.lift(marker)
-
-        data = [x_cur, y_cur, x_1, y_1, x_2, y_2]
-        logger.log_data(data)
-
-        root.update()
-        time.sleep(0.1)
\ No newline at end of file
+    # Only appends the row to the buffer, so the caller never waits for the disk
+    def log_data(self, data):
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped_rows += 1
+            self.buffer.append(data)
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+
+    # Runs on the writer thread and writes the buffer when it is full enough or the flush interval has passed
+    def write_loop(self):
+        while True:
+            with self.condition:
+                if not self.closed and len(self.buffer) < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+                rows = list(self.buffer)
+                self.buffer.clear()
+                closed = self.closed
+
+            if rows:
+                profiler = self.profiler
+                if profiler is not None:
+                    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                self.writer.writerows(rows)
+                self.file.flush()
+                if profiler is not None:
+                    profiler.record("csv write", wall_start, cpu_start)
+            if closed:
+                break
+
+    # Writes all buffered rows and closes the file
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.file.close()
+        if self.dropped_rows:
+            print(f"csv_Logger: {self.dropped_rows} rows were dropped because the buffer was full")
+
+    # Reads a log into one float array per column, "Null" values become NaN
+    @staticmethod
+    def read_log(filename):
+        with open(filename, newline="") as file:
+            header = next(csv.reader(file))
+            text = file.read().replace("Null", "nan")
+
+        if text.strip():
+            data = np.loadtxt(io.StringIO(text), delimiter=",", ndmin=2, dtype=np.float64)
+        else:
+            data = np.empty((0, len(header)))
+        columns = {name: data[:, i] for i, name in enumerate(header)}
+        return header, columns
+
+    # Writes columns in the format of log_data, whole numbers without decimals and NaN as "Null"
+    @staticmethod
+    def write_log(filename, header, columns, fmt="%.10g"):
+        data = np.column_stack([columns[name] for name in header]) if header else np.empty((0, 0))
+        text = io.StringIO()
+        np.savetxt(text, data, fmt=fmt, delimiter=",", newline="\r\n")
+        with open(filename, mode="w", newline="") as file:
+            file.write(",".join(header) + "\r\n")
+            file.write(text.getvalue().replace("nan", "Null"))
+
+# Binary file of fixed-width NumPy records: a JSON header followed by the records, so the file can be memory-mapped
+class BinaryRecording:
+    magic = b"EYEREC01"
+    header_alignment = 64
+
+    def __init__(self, filename, dtype, metadata=None, chunk_size=1024, flush_interval=5.0):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval    # Seconds after which a partly filled chunk is written anyway
+        self.records = 0
+
+        header = {
+            "dtype": self.dtype.descr,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "metadata": metadata or {}
+        }
+        header_bytes = json.dumps(header).encode()
+        header_size = len(BinaryRecording.magic) + 4 + len(header_bytes)
+        header_bytes += b" " * (-header_size % BinaryRecording.header_alignment)
+
+        self.file = open(filename, mode="wb")
+        self.file.write(BinaryRecording.magic)
+        self.file.write(len(header_bytes).to_bytes(4, "little"))
+        self.file.write(header_bytes)
+        self.file.flush()
+
+        # Records are collected in a preallocated chunk, full chunks are written by the writer thread
+        self.chunk = np.zeros(chunk_size, dtype=self.dtype)
+        self.chunk_fill = 0
+        self.last_flush = time.perf_counter()
+        self.chunks = queue.Queue()
+        self.closed = False
+        self.profiler = None
+
+        self.thread = threading.Thread(target=self.write_loop, name="BinaryRecording", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Adds one record, given as a tuple in the order of the dtype fields
+    def append(self, record):
+        if self.closed:
+            return
+        self.chunk[self.chunk_fill] = record
+        self.chunk_fill += 1
+        self.records += 1
+        if self.chunk_fill == self.chunk_size or time.perf_counter() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    # Hands the filled part of the chunk to the writer thread and starts a new chunk
+    def flush(self):
+        if self.chunk_fill:
+            self.chunks.put(self.chunk[:self.chunk_fill])
+            self.chunk = np.zeros(self.chunk_size, dtype=self.dtype)
+            self.chunk_fill = 0
+        self.last_flush = time.perf_counter()
+
+    def write_loop(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            profiler = self.profiler
+            if profiler is not None:
+                wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            self.file.write(chunk.tobytes())
+            self.file.flush()
+            if profiler is not None:
+                profiler.record("recording write", wall_start, cpu_start)
+
+    # Writes the remaining records and closes the file
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self.chunks.put(None)
+        self.thread.join()
+        self.file.close()
+
+    # Returns the header and the records as a read-only memory map, an incomplete last record is ignored
+    @staticmethod
+    def load(filename):
+        with open(filename, mode="rb") as file:
+            if file.read(len(BinaryRecording.magic)) != BinaryRecording.magic:
+                raise ValueError(f"{filename} is not a recording")
+            header_length = int.from_bytes(file.read(4), "little")
+            header = json.loads(file.read(header_length))
+
+        dtype = np.dtype([tuple(field) for field in header["dtype"]])
+        offset = len(BinaryRecording.magic) + 4 + header_length
+        count = (os.path.getsize(filename) - offset) // dtype.itemsize
+        if count == 0:
+            return header, np.zeros(0, dtype=dtype)
+        return header, np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+# Everything the acquisition loop computes for one gaze sample. Missing gaze values are NaN, missing integers -1
+GAZE_RECORD_DTYPE = np.dtype([
+    ("timestamp", "<f4"),   # time.perf_counter() when the sample was read minus "start_time" of the metadata, below 0.5 ms steps for 2 h
+    ("cursor_x", "<i2"),
+    ("cursor_y", "<i2"),
+    ("raw_x", "<f4"),
+    ("raw_y", "<f4"),
+    ("adjusted_x", "<f4"),
+    ("adjusted_y", "<f4"),
+    ("is_lost", "i1"),  # -1 if the tracker was not connected
+    ("confidence", "i1"),   # Value of TrackingConfidence
+    ("tag", "i1"),  # Index in SEMANTIC_TAGS, see TAG_TO_INDEX
+    ("instance_id", "<i4"),  # Green value << 8 | blue value, -1 if there is no result
+    ("segmentation_score", "<f2"),  # NaN if there is no result
+    ("segmentation_frame", "<i4"),
+    ("segmentation_age", "<f2"),  # Seconds between the gaze sample of the segmentation result and this sample
+    ("segmentation_skew", "<f2"),  # Seconds between the frame of the segmentation result and the nearest gaze sample
+    ("aoi", "<i2")  # Index in the "aois" list of the metadata, -1 if the gaze is in no area of interest
+])
+
+# Look direction and grid cell are not recorded, LookDirection computes them from the adjusted gaze
+class GazeRecorder(BinaryRecording):
+    def __init__(self, filename=None, metadata=None, chunk_size=1024, flush_interval=5.0, start_time=None):
+        if filename is None:
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            filename = f"Eye_Track_Recording_{timestamp}.eyerec"
+        # Timestamps are stored as float32 seconds since start_time, which keeps the records small
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        metadata = dict(metadata or {}, start_time=self.start_time)
+        super().__init__(filename, GAZE_RECORD_DTYPE, metadata, chunk_size, flush_interval)
+
+    @staticmethod
+    def number(value, missing):
+        return missing if value == "Null" or value is None else value
+
+    # Converts a sample and what was computed from it into one record
+    def record_sample(self, sample, segmentation_result, aoi_index=-1):
+        tracking_data = sample.tracking_data
+        number = GazeRecorder.number
+        connected = sample.connected
+
+        instance_id = -1
+        if segmentation_result.instance_id != "Null":
+            g, b = segmentation_result.instance_id.split("-")
+            instance_id = int(g) << 8 | int(b)
+
+        self.append((
+            sample.timestamp - self.start_time,
+            number(sample.cursor_x, -1),
+            number(sample.cursor_y, -1),
+            number(sample.raw_x, np.nan),
+            number(sample.raw_y, np.nan),
+            number(tracking_data[4], np.nan),
+            number(tracking_data[5], np.nan),
+            int(tracking_data[1]) if connected else -1,
+            getattr(tracking_data[2], "value", -1) if connected else -1,
+            TAG_TO_INDEX.get(segmentation_result.tag, -2),
+            instance_id,
+            segmentation_result.score if instance_id >= 0 else np.nan,
+            number(segmentation_result.frame, -1),
+            sample.timestamp - segmentation_result.sample_timestamp if segmentation_result.frame is not None else np.nan,
+            number(segmentation_result.skew, np.nan),
+            aoi_index
+        ))
+
+    # Columns in the format of csv_Logger, so the recording can be written with csv_Logger.write_log
+    @staticmethod
+    def log_columns(records):
+        columns = {
+            "Cursor x": records["cursor_x"].astype(np.float64),
+            "Cursor y": records["cursor_y"].astype(np.float64),
+            "Beam Eye Pos. x": records["raw_x"].astype(np.float64),
+            "Beam Eye Pos. y": records["raw_y"].astype(np.float64),
+            "Adjusted x": records["adjusted_x"].astype(np.float64),
+            "Adjusted y": records["adjusted_y"].astype(np.float64)
+        }
+        return list(columns), columns
+
+# One recorded segmentation frame, pixels are the BGRA bytes as CARLA delivers them
+def segmentation_frame_dtype(width, height):
+    return np.dtype([
+        ("timestamp", "<f8"),   # time.perf_counter() when the frame arrived
+        ("frame", "<i8"),
+        ("sim_timestamp", "<f8"),
+        ("pixels", "u1", (height, width, 4))
+    ])
+
+# Frame with the attributes of carla.Image that the segmentation lookup uses, for recorded and generated frames
+class SensorImage:
+    __slots__ = ("raw_data", "width", "height", "frame", "timestamp")
+
+    def __init__(self, raw_data, width, height, frame, timestamp):
+        self.raw_data = raw_data
+        self.width = width
+        self.height = height
+        self.frame = frame
+        self.timestamp = timestamp
+
+    # Frame from a recording of CarlaClient.record_frame
+    @staticmethod
+    def from_record(record):
+        pixels = record["pixels"]
+        return SensorImage(memoryview(np.ascontiguousarray(pixels)).cast("B"), pixels.shape[1], pixels.shape[0], int(record["frame"]), float(record["sim_timestamp"]))
+
+# Runs recorded gaze samples and segmentation frames through the processing chain without tracker, simulator or Win32
+class ReplayEngine:
+    def __init__(self, correct_curvature, look_direction, carla_client=None, section_amount=16, recorder=None, gaze_filter=None):
+        self.correct_curvature = correct_curvature
+        self.look_direction = look_direction
+        self.carla_client = carla_client if carla_client is not None else CarlaClient()
+        self.section_amount = section_amount
+        self.recorder = recorder    # Optional GazeRecorder that stores the replayed results for comparisons
+        self.gaze_filter = gaze_filter  # Smooths the gaze before the correction like in a session with --smooth
+        self.frames = None
+        self.stage_times = collections.Counter()
+
+    # Reads a csv_Logger file or a gaze recording. CSV logs have no timestamps, their samples are spaced at the given rate
+    def load_gaze(self, filename, rate=30):
+        if filename.endswith(".csv"):
+            header, columns = csv_Logger.read_log(filename)
+            raw_x, raw_y = columns["Beam Eye Pos. x"], columns["Beam Eye Pos. y"]
+            connected = ~(np.isnan(raw_x) | np.isnan(raw_y))
+            self.gaze = {
+                "timestamp": np.arange(len(raw_x)) / rate,
+                "cursor_x": columns["Cursor x"],
+                "cursor_y": columns["Cursor y"],
+                "raw_x": raw_x,
+                "raw_y": raw_y,
+                "connected": connected,
+                "is_lost": np.zeros(len(raw_x), dtype=np.int8),
+                "confidence": np.full(len(raw_x), -1, dtype=np.int8)
+            }
+        else:
+            header, records = BinaryRecording.load(filename)
+            self.gaze = {name: records[name] for name in ("cursor_x", "cursor_y", "raw_x", "raw_y", "is_lost", "confidence")}
+            # Timestamps are relative to the start time, frame recordings keep the absolute time.perf_counter() values.
+            # Older recordings have absolute timestamps, no start time and a connected field
+            self.gaze["timestamp"] = records["timestamp"].astype(np.float64) + header["metadata"].get("start_time", 0.0)
+            self.gaze["connected"] = records["connected"] != 0 if "connected" in records.dtype.names else records["is_lost"] >= 0
+        return len(self.gaze["timestamp"])
+
+    # Reads segmentation frames written by CarlaClient.record_frame, they are memory-mapped and not loaded at once
+    def load_frames(self, filename):
+        header, self.frames = BinaryRecording.load(filename)
+        return len(self.frames)
+
+    # Builds the tracking data list of EyeTracker.get_trackingdata from the recorded values of one sample
+    @staticmethod
+    def tracking_data(connected, is_lost, confidence, raw_x, raw_y):
+        if not connected:
+            return ["Tracker not connected", "Null", "Null", "Null", "Null", "Null"]
+        confidence = TrackingConfidence(confidence) if confidence >= 0 else "Null"
+        raw_x, raw_y = float(raw_x), float(raw_y)
+        if raw_x.is_integer():
+            raw_x = int(raw_x)
+        if raw_y.is_integer():
+            raw_y = int(raw_y)
+        return ["Tracker connected", bool(is_lost), confidence, EyeTracker.confidence_color(confidence), raw_x, raw_y]
+
+    # Replays all samples as fast as possible, or paced by the recorded timestamps (speed 1 is real time).
+    # on_sample is called with the sample and its segmentation result. Returns the number of samples per second
+    def run(self, realtime=False, speed=1.0, on_sample=None):
+        gaze = self.gaze
+        columns = [gaze[name].tolist() for name in ("timestamp", "cursor_x", "cursor_y", "raw_x", "raw_y", "connected", "is_lost", "confidence")]
+        # The filter runs over the whole stream at once, the correction gets the filtered and the sample the raw gaze
+        filtered_columns = columns[3:5]
+        if self.gaze_filter is not None:
+            stage_start = time.perf_counter()
+            filtered_x, filtered_y = self.gaze_filter.filter_batch(
+                gaze["timestamp"],
+                np.where(gaze["connected"], gaze["raw_x"], np.nan),
+                np.where(gaze["connected"], gaze["raw_y"], np.nan),
+                gaze["confidence"],
+                gaze["is_lost"]
+            )
+            filtered_columns = [filtered_x.tolist(), filtered_y.tolist()]
+            self.stage_times["filter"] += time.perf_counter() - stage_start
+        frame_times = self.frames["timestamp"] if self.frames is not None else np.empty(0)
+        next_frame = 0
+        latest_result = self.carla_client.latest_result
+        gaze_join = self.carla_client.gaze_join
+        stage_times = self.stage_times
+        clock = time.perf_counter
+
+        start = clock()
+        first_timestamp = columns[0][0] if columns[0] else 0.0
+        sample = None
+        for timestamp, cursor_x, cursor_y, raw_x, raw_y, connected, is_lost, confidence, filtered_x, filtered_y in zip(*columns, *filtered_columns):
+            if realtime:
+                delay = start + (timestamp - first_timestamp) / speed - clock()
+                if delay > 0:
+                    time.sleep(delay)
+
+            # Frames that arrived before this sample are processed with the previous sample, as in a live session
+            while next_frame < len(frame_times) and frame_times[next_frame] <= timestamp:
+                if sample is not None:
+                    stage_start = clock()
+                    self.carla_client.process_segmentation_image(SensorImage.from_record(self.frames[next_frame]), sample, float(frame_times[next_frame]))
+                    stage_times["segmentation"] += clock() - stage_start
+                next_frame += 1
+
+            stage_start = clock()
+            tracking_data = self.correct_curvature.correct(ReplayEngine.tracking_data(connected, is_lost, confidence, filtered_x, filtered_y))
+            stage_mid = clock()
+            stage_times["correction"] += stage_mid - stage_start
+
+            sample = GazeSample(timestamp, tuple(tracking_data), raw_x if connected else "Null", raw_y if connected else "Null", cursor_x, cursor_y)
+            if gaze_join is not None:
+                gaze_join.add_sample(sample)
+            aoi_index = self.look_direction.look_direction_aoi_index(sample.tracking_data)
+            stage_end = clock()
+            stage_times["look direction"] += stage_end - stage_mid
+
+            if self.recorder is not None:
+                self.recorder.record_sample(sample, latest_result.get(), aoi_index)
+                stage_times["recording"] += clock() - stage_end
+            if on_sample is not None:
+                on_sample(sample, latest_result.get())
+
+        elapsed = clock() - start
+        return len(columns[0]) / elapsed if elapsed > 0 else float("inf")
+
+class FixedRateScheduler:
+    def __init__(self, rate, spin_time=0.001):
+        self.interval = 1/rate
+        self.spin_time = spin_time  # The last part of every wait polls the clock, because time.sleep may wake up too late
+
+        # Deadlines are absolute times on the monotonic performance counter, so the rate does not drift
+        self.next_deadline = None
+        self.ticks = 0
+        self.overruns = 0   # Ticks that started after their deadline
+        self.dropped_ticks = 0  # Deadlines that were skipped completely because a tick took more than one interval
+
+    # Sleeps until the next deadline and returns the number of ticks dropped since the previous call
+    def wait(self):
+        now = time.perf_counter()
+        if self.next_deadline is None:  # The first tick starts immediately
+            self.next_deadline = now
+        lateness = now - self.next_deadline
+        dropped = 0
+
+        if lateness > 0:
+            self.overruns += 1
+            dropped = int(lateness // self.interval)
+            self.dropped_ticks += dropped
+            self.next_deadline += dropped * self.interval
+        else:
+            remaining = -lateness
+            if remaining > self.spin_time:
+                time.sleep(remaining - self.spin_time)
+            while time.perf_counter() < self.next_deadline:
+                pass
+
+        self.ticks += 1
+        self.next_deadline += self.interval
+        return dropped
+
+    def stats(self):
+        return f"{self.ticks} ticks at {1/self.interval:.1f} Hz, {self.overruns} overruns, {self.dropped_ticks} dropped ticks"
+
+# Corrected gaze sample as it is handed between threads. It is a tuple, so it can not be changed after it has been published
+class GazeSample(collections.namedtuple("GazeSample", ("timestamp", "tracking_data", "raw_x", "raw_y", "cursor_x", "cursor_y"))):
+    __slots__ = ()
+
+    @property
+    def connected(self):
+        return self.tracking_data[0] == "Tracker connected"
+
+    @property
+    def x(self):
+        return self.tracking_data[4]
+
+    @property
+    def y(self):
+        return self.tracking_data[5]
+
+# Instance under the gaze point, sample_timestamp is the timestamp of the gaze sample that was used for the lookup,
+# score the share of the pixels around the gaze point that carry the tag and skew the time between the frame and the
+# nearest gaze sample (None without GazeFrameJoin)
+class SegmentationResult(collections.namedtuple("SegmentationResult", ("tag", "instance_id", "sample_timestamp", "frame", "timestamp", "score", "skew"), defaults=(1.0, None))):
+    __slots__ = ()
+
+# Single slot that always holds the newest sample. Replacing the reference is atomic, so readers never need a lock
+class LatestSample:
+    def __init__(self, value=None):
+        self.value = value
+
+    def publish(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+# Joins every segmentation frame with the gaze of the moment the frame shows instead of the sample that is current when
+# the callback runs. The gaze samples are kept in a short ring ordered by time, the simulation time of a frame is mapped
+# to time.perf_counter() by the tick times of a synchronous simulation or else by a line below the arrival times of the
+# last frames, which also follows a simulation that runs slower or faster than the wall clock
+class GazeFrameJoin:
+    def __init__(self, capacity=512, interpolate=True, max_gap=0.1, clock_window=64, skew_window=4096):
+        self.capacity = capacity
+        self.samples = [None] * capacity
+        self.count = 0  # Samples added so far, only the acquisition thread adds
+        self.interpolate = interpolate
+        self.max_gap = max_gap  # Samples further apart than this (s) are not interpolated
+
+        # perf_counter() time of the last ticks by frame number, only in synchronous mode
+        self.tick_frames = [-1] * clock_window
+        self.tick_times = [0.0] * clock_window
+        # Simulation and arrival time of the last frames for the clock mapping
+        self.sim_times = np.zeros(clock_window)
+        self.arrivals = np.zeros(clock_window)
+        self.frames = 0
+        self.rate = 1.0     # Seconds on the perf_counter() clock per second of simulation time
+
+        self.skews = [0.0] * skew_window
+        self.joined = 0
+        self.ticked = 0     # Frames whose time is the recorded tick time
+        self.interpolated = 0   # Frames joined with gaze interpolated between two samples
+        self.missing = 0
+
+    def add_sample(self, sample):
+        count = self.count
+        self.samples[count % self.capacity] = sample
+        self.count = count + 1
+
+    # Called by the thread that ticks a synchronous simulation
+    def add_tick(self, frame, timestamp):
+        index = frame % len(self.tick_frames)
+        self.tick_times[index] = timestamp
+        self.tick_frames[index] = frame
+
+    # perf_counter() time of the moment the frame shows, arrival is the perf_counter() time the frame was received.
+    # Arrival is the moment the frame shows plus a delay of at least zero, so the mapping is the lower envelope of the
+    # arrivals: its rate goes through the frames with the least delay in the older and the newer half of the window,
+    # its offset through the frame with the least delay overall. A delay that all frames share can not be told apart from
+    # the offset, only the tick times of a synchronous simulation remove it
+    def frame_time(self, image, arrival):
+        window = len(self.sim_times)
+        self.sim_times[self.frames % window] = image.timestamp
+        self.arrivals[self.frames % window] = arrival
+        self.frames += 1
+        index = image.frame % len(self.tick_frames)
+        if self.tick_frames[index] == image.frame:
+            self.ticked += 1
+            return self.tick_times[index]
+
+        count = min(self.frames, window)
+        sim_times = self.sim_times[:count]
+        arrivals = self.arrivals[:count]
+        rate = self.rate
+        # The rate changes slowly, it is only estimated again every 8 frames
+        if self.frames % 8 == 0 and np.ptp(sim_times) > 0:
+            older = sim_times < (sim_times.min() + sim_times.max()) / 2
+            # The frames with the least delay depend on the rate, a few rounds settle both
+            for iteration in range(3):
+                delays = arrivals - rate * sim_times
+                first = np.argmin(np.where(older, delays, np.inf))
+                last = np.argmin(np.where(older, np.inf, delays))
+                rate = (arrivals[last] - arrivals[first]) / (sim_times[last] - sim_times[first])
+            self.rate = rate
+        return float(np.min(arrivals - rate * sim_times) + rate * image.timestamp)
+
+    # Gaze at the given time, the skew, the time of the nearest sample minus the given time (negative if the gaze is
+    # older), and whether the gaze was interpolated, which it is between two connected samples that are not lost. None
+    # if there are no samples yet
+    def sample_at(self, timestamp):
+        samples = self.samples
+        capacity = self.capacity
+        count = self.count
+        oldest = max(count - capacity + 1, 0)    # The oldest slot may just be overwritten
+        if oldest >= count:
+            return None, None, False
+
+        # Binary search for the first sample after the given time
+        low, high = oldest, count
+        while low < high:
+            middle = (low + high) // 2
+            if samples[middle % capacity].timestamp <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        before = samples[(low - 1) % capacity] if low > oldest else None
+        after = samples[low % capacity] if low < count else None
+
+        if before is None:
+            return after, after.timestamp - timestamp, False
+        if after is None:
+            return before, before.timestamp - timestamp, False
+        nearest = before if timestamp - before.timestamp <= after.timestamp - timestamp else after
+        skew = nearest.timestamp - timestamp
+        if self.interpolate and after.timestamp - before.timestamp <= self.max_gap and before.connected and after.connected and not before.tracking_data[1] and not after.tracking_data[1]:
+            weight = (timestamp - before.timestamp) / (after.timestamp - before.timestamp)
+            tracking_data = list(nearest.tracking_data)
+            tracking_data[4] = round(before.x + (after.x - before.x) * weight)
+            tracking_data[5] = round(before.y + (after.y - before.y) * weight)
+            raw_x = round(before.raw_x + (after.raw_x - before.raw_x) * weight)
+            raw_y = round(before.raw_y + (after.raw_y - before.raw_y) * weight)
+            return GazeSample(timestamp, tuple(tracking_data), raw_x, raw_y, nearest.cursor_x, nearest.cursor_y), skew, True
+        return nearest, skew, False
+
+    # Called by the segmentation callback, returns the gaze sample for the frame and the skew
+    def join(self, image, arrival):
+        frame_time = self.frame_time(image, arrival)
+        sample, skew, interpolated = self.sample_at(frame_time)
+        if sample is None:
+            self.missing += 1
+            return None, None
+        self.skews[self.joined % len(self.skews)] = skew
+        self.joined += 1
+        if interpolated:
+            self.interpolated += 1
+        return sample, skew
+
+    def stats(self):
+        count = min(self.joined, len(self.skews))
+        if count == 0:
+            return f"no frame joined, {self.missing} without gaze"
+        p50, p95, p99 = np.percentile(np.abs(self.skews[:count]), (50, 95, 99)) * 1000
+        return f"{self.joined} frames joined, {self.ticked} at tick times, {self.interpolated} interpolated, {self.missing} without gaze, skew p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms"
+
+# Rolling latency histograms of the pipeline stages from the gaze sample to the label and the overlay. Every stage keeps
+# its last durations in a ring, percentiles are only computed when they are shown. Without a monitor no timestamps are taken
+class LatencyMonitor:
+    stages = ("tracker read", "correction", "log write", "handoff", "lookup", "gaze to label", "gaze to label logged", "overlay draw", "gaze to overlay")
+
+    def __init__(self, window=4096):
+        self.window = window
+        self.durations = {stage: [0.0] * window for stage in LatencyMonitor.stages}
+        self.counts = dict.fromkeys(LatencyMonitor.stages, 0)
+
+    # Duration in seconds, every stage is only recorded by one thread
+    def record(self, stage, duration):
+        count = self.counts[stage]
+        self.durations[stage][count % self.window] = duration
+        self.counts[stage] = count + 1
+
+    # p50, p95 and p99 in seconds over the durations in the window, None if the stage has not been recorded yet
+    def percentiles(self, stage):
+        count = min(self.counts[stage], self.window)
+        if count == 0:
+            return None
+        return tuple(float(value) for value in np.percentile(self.durations[stage][:count], (50, 95, 99)))
+
+    def summary(self, stages=None):
+        lines = []
+        for stage in stages or LatencyMonitor.stages:
+            percentiles = self.percentiles(stage)
+            if percentiles is not None:
+                lines.append(f"{stage}: p50 {percentiles[0]*1000:.2f} ms, p95 {percentiles[1]*1000:.2f} ms, p99 {percentiles[2]*1000:.2f} ms")
+        return lines
+
+    def save(self, filename):
+        report = {}
+        for stage in LatencyMonitor.stages:
+            percentiles = self.percentiles(stage)
+            if percentiles is not None:
+                report[stage] = {"samples": self.counts[stage], "p50 ms": percentiles[0]*1000, "p95 ms": percentiles[1]*1000, "p99 ms": percentiles[2]*1000}
+        with open(filename, mode="w") as file:
+            json.dump({"window": self.window, "stages": report}, file, indent=4)
+
+# Opt-in profiler: samples the stacks of all threads into collapsed stacks for flamegraph.pl and records the wall and
+# CPU time of every stage tick as Chrome trace (chrome://tracing, Perfetto). Both files are rewritten every write_interval
+class Profiler:
+    def __init__(self, filename_prefix=None, sample_interval=0.005, write_interval=10.0, max_events=200000):
+        if filename_prefix is None:
+            filename_prefix = f"Profile_{time.strftime('%Y%m%d_%H%M%S')}"
+        self.collapsed_filename = filename_prefix + ".collapsed"
+        self.trace_filename = filename_prefix + ".trace.json"
+        self.sample_interval = sample_interval
+        self.write_interval = write_interval
+
+        self.stacks = collections.Counter()     # "thread;outer;...;inner" -> number of samples
+        self.events = collections.deque(maxlen=max_events)   # (stage, thread id, start, wall time, CPU time), the oldest are dropped
+        self.thread_names = {}
+        self.thread_cpu = {}    # Thread id -> CPU time in the recorded stages
+        self.stage_totals = {}  # Stage -> [ticks, wall time, CPU time, longest wall time]
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.sample_loop, name="Profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # Ends a stage tick on the calling thread that began at wall_start (time.perf_counter) and cpu_start (time.thread_time)
+    def record(self, stage, wall_start, cpu_start):
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.thread_time() - cpu_start
+        ident = threading.get_ident()
+        if ident not in self.thread_names:
+            self.thread_names[ident] = threading.current_thread().name
+        self.events.append((stage, ident, wall_start, wall_time, cpu_time))
+        self.thread_cpu[ident] = self.thread_cpu.get(ident, 0.0) + cpu_time
+
+        totals = self.stage_totals.get(stage)
+        if totals is None:
+            totals = self.stage_totals[stage] = [0, 0.0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += wall_time
+        totals[2] += cpu_time
+        totals[3] = max(totals[3], wall_time)
+
+    def sample_loop(self):
+        own_ident = threading.get_ident()
+        next_write = time.perf_counter() + self.write_interval
+        while not self.stop_event.wait(self.sample_interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+            if time.perf_counter() >= next_write:
+                next_write += self.write_interval
+                self.write()
+
+    def write(self):
+        with open(self.collapsed_filename, mode="w") as file:
+            for stack, count in list(self.stacks.items()):
+                file.write(f"{stack} {count}\n")
+
+        process_id = os.getpid()
+        trace = [{"name": "thread_name", "ph": "M", "pid": process_id, "tid": ident, "args": {"name": name}} for ident, name in list(self.thread_names.items())]
+        for stage, ident, start, wall_time, cpu_time in list(self.events):
+            trace.append({"name": stage, "ph": "X", "pid": process_id, "tid": ident, "ts": start*1e6, "dur": wall_time*1e6, "args": {"cpu ms": cpu_time*1000}})
+        with open(self.trace_filename, mode="w") as file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.write()
+
+    def summary(self):
+        lines = []
+        for stage, (ticks, wall_time, cpu_time, longest) in sorted(self.stage_totals.items()):
+            lines.append(f"{stage}: {ticks} ticks, mean {wall_time/ticks*1000:.3f} ms, longest {longest*1000:.2f} ms, CPU {cpu_time:.2f} s")
+        for ident, cpu_time in self.thread_cpu.items():
+            lines.append(f"thread {self.thread_names[ident]}: CPU {cpu_time:.2f} s in recorded stages")
+        return lines
+
+# Shows camera images with OpenCV on its own thread, so the CARLA sensor callbacks never wait for HighGUI
+class FrameDisplay(threading.Thread):
+    def __init__(self, rate=30):
+        super().__init__(name="FrameDisplay", daemon=True)
+        self.windows = {}   # Window name -> single slot with the newest image, older images are simply replaced
+        self.scheduler = FixedRateScheduler(rate)
+        self.stop_event = threading.Event()
+        self.shown_frames = 0
+        self.skipped_frames = 0  # Images that were replaced before they could be shown
+        self.profiler = None
+
+    # Returns the slot the sensor callback publishes its images to
+    def add_window(self, name):
+        self.windows[name] = LatestSample(None)
+        return self.windows[name]
+
+    def run(self):
+        shown = {}
+        while not self.stop_event.is_set():
+            self.scheduler.wait()
+            profiler = self.profiler
+            if profiler is not None:
+                wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            for name, window in self.windows.items():
+                image = window.get()
+                if image is None or image is shown.get(name):
+                    continue
+                if name in shown:
+                    self.skipped_frames += max(image.frame - shown[name].frame - 1, 0)
+                shown[name] = image
+
+                array = np.frombuffer(image.raw_data, dtype=np.uint8)
+                array = np.reshape(array, (image.height, image.width, 4))
+                cv2.imshow(name, array)
+                self.shown_frames += 1
+            cv2.waitKey(1)
+            if profiler is not None:
+                profiler.record("camera display", wall_start, cpu_start)
+        cv2.destroyAllWindows()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def stats(self):
+        return f"{self.shown_frames} frames shown, {self.skipped_frames} stale frames skipped"
+
+# Polls the Eye-Tracker at its own rate, independent of how long the Tk window needs to redraw
+class AcquisitionThread(threading.Thread):
+    def __init__(self, eye_tracker, correct_curvature, logger, latest_sample, rate, recorder=None, look_direction=None, section_amount=16, latest_result=None, cursor_position=None, latency_monitor=None, fixation_detector=None, attention_map=None, gaze_filter=None):
+        super().__init__(name="Acquisition", daemon=True)
+        self.cursor_position = cursor_position if cursor_position is not None else pyautogui.position
+        self.eye_tracker = eye_tracker
+        self.correct_curvature = correct_curvature
+        self.logger = logger
+        self.latest_sample = latest_sample
+
+        # The recording also stores the look direction and the newest segmentation result of every sample
+        self.recorder = recorder
+        self.look_direction = look_direction
+        self.section_amount = section_amount
+        self.latest_result = latest_result
+        self.scheduler = FixedRateScheduler(rate)
+        self.stop_event = threading.Event()
+        self.error = None
+
+        self.latency_monitor = latency_monitor
+        self.logged_result = None   # Last segmentation result that went into the recording
+        self.profiler = None
+        self.fixation_detector = fixation_detector
+        self.attention_map = attention_map
+        self.gaze_filter = gaze_filter  # Smooths the gaze before the correction, the log keeps the raw values
+        self.gaze_join = None   # GazeFrameJoin that keeps the samples for the segmentation frames
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                self.scheduler.wait()
+                latency = self.latency_monitor
+                profiler = self.profiler
+                if profiler is not None:
+                    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+
+                x_cur, y_cur = self.cursor_position() # Reads out cursor position -> Use it to know where you looked
+
+                # The timestamp is taken right before the tracker is read, all latencies are measured from it
+                timestamp = time.perf_counter()
+                tracking_data_unadjusted = self.eye_tracker.get_trackingdata()
+                if latency is not None:
+                    read_time = time.perf_counter()
+                x_1 = tracking_data_unadjusted[4]
+                y_1 = tracking_data_unadjusted[5]
+                if self.gaze_filter is not None:
+                    tracking_data_unadjusted = self.gaze_filter.filter(tracking_data_unadjusted, timestamp)
+
+                # Calibration & Curvature Correction
+                tracking_data = self.correct_curvature.correct(tracking_data_unadjusted)
+                #tracking_data = calibration.add_offset(tracking_data) # Calibration is deactivated since curvature correction works better
+
+                # For testing the original calibration is not done anymore. Only curvature calibration is done.
+                # If calibration needs to be implemented again the curvature correction also needs to applied in line 96 where the calibration takes place.
+                # Curvature Correciton must be done before screen calibration!!
+                if latency is not None:
+                    corrected_time = time.perf_counter()
+                    latency.record("tracker read", read_time - timestamp)
+                    latency.record("correction", corrected_time - read_time)
+
+                sample = GazeSample(timestamp, tuple(tracking_data), x_1, y_1, x_cur, y_cur)
+                self.latest_sample.publish(sample)
+                if self.gaze_join is not None:
+                    self.gaze_join.add_sample(sample)
+
+                # The logger and the recorder only buffer the data, their own threads write the full stream to disk
+                if self.logger is not None:
+                    self.logger.log_data([x_cur, y_cur, x_1, y_1, tracking_data[4], tracking_data[5]])
+                segmentation_result = self.latest_result.get() if self.latest_result is not None else None
+                if self.recorder is not None:
+                    self.recorder.record_sample(
+                        sample,
+                        segmentation_result,
+                        self.look_direction.look_direction_aoi_index(sample.tracking_data)
+                    )
+                if latency is not None:
+                    logged_time = time.perf_counter()
+                    latency.record("log write", logged_time - corrected_time)
+                    # A label is logged with the first sample after the lookup, measured from the gaze sample it belongs to
+                    if self.recorder is not None and segmentation_result is not self.logged_result and segmentation_result.frame is not None:
+                        self.logged_result = segmentation_result
+                        latency.record("gaze to label logged", logged_time - segmentation_result.sample_timestamp)
+
+                # Attention map and fixation detection are analysis and not part of the logging path, so they run after
+                # the latency is taken
+                if self.attention_map is not None:
+                    coordinates = None
+                    if self.look_direction is not None:
+                        coordinates = self.look_direction.look_direction_coordinates(sample.tracking_data, self.section_amount)
+                    self.attention_map.add_sample(sample, coordinates)
+                if self.fixation_detector is not None:
+                    self.fixation_detector.add_sample(sample, segmentation_result)
+
+                if profiler is not None:
+                    profiler.record("acquisition", wall_start, cpu_start)
+        except Exception as error:
+            self.error = error
+            raise
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+# Ticks a synchronous simulation at the real-time rate of its fixed step, so simulation and gaze run at the same pace.
+# The time of every tick is handed to the join, it is taken before the tick because the frames may arrive before it returns
+class SimulationTicker(threading.Thread):
+    def __init__(self, simulator, fixed_delta, gaze_join=None):
+        super().__init__(name="SimulationTicker", daemon=True)
+        self.simulator = simulator
+        self.gaze_join = gaze_join
+        self.scheduler = FixedRateScheduler(1 / fixed_delta)
+        self.stop_event = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            frame = None
+            while not self.stop_event.is_set():
+                self.scheduler.wait()
+                tick_time = time.perf_counter()
+                # Frame numbers of a synchronous world count up by one per tick. The first frame number is only known
+                # after the first tick, it is added then for frames that arrive after tick() returned
+                if frame is not None and self.gaze_join is not None:
+                    self.gaze_join.add_tick(frame + 1, tick_time)
+                previous_frame = frame
+                frame = self.simulator.tick()
+                if self.gaze_join is not None and (previous_frame is None or frame != previous_frame + 1):
+                    self.gaze_join.add_tick(frame, tick_time)
+        except Exception as error:
+            self.error = error
+            raise
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Eye-Tracker overlay with instance lookup in CARLA")
+    parser.add_argument("--fake", action="store_true", help="Synthetic gaze and simulated cameras instead of Beam, CARLA and the Win32 screen, without curvature correction")
+    parser.add_argument("--headless", action="store_true", help="No windows, only acquisition, instance lookup and logging")
+    parser.add_argument("--tracker-rate", type=float, default=30, help="Rate of the Eye Tracker readout (Hz)")
+    parser.add_argument("--display-rate", type=float, help="Rate of the window redraw (Hz, default: refresh rate of the monitor, 60 with --fake)")
+    parser.add_argument("--screen-size", default="1920x1080", help="Screen size with --fake, e.g. 2560x1440")
+    parser.add_argument("--gaze-noise", type=float, default=15, help="Noise of the synthetic gaze with --fake (px)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic gaze and cameras with --fake")
+    parser.add_argument("--duration", type=float, help="Stops after this many seconds")
+    parser.add_argument("--smooth", action="store_true", help="Smooths the gaze with a One Euro filter before the curvature correction")
+    parser.add_argument("--segmentation-scale", type=float, default=10, help="Screen pixels per pixel of the segmentation camera")
+    parser.add_argument("--csv-log", action="store_true", help="Also writes the Eye_Track_Log_*.csv log during the session")
+    parser.add_argument("--record-frames", action="store_true", help="Records the segmentation frames into Segmentation_Frames_*.eyerec for replay.py --frames")
+    parser.add_argument("--user", default="default", help="Name of the calibration profile in calibration_profiles/")
+    parser.add_argument("--calibrate", action="store_true", help="Calibrates on a grid of targets before the start, even if the user has a profile")
+    parser.add_argument("--calibration-grid", default="3x3", help="Columns x rows of the calibration targets")
+    parser.add_argument("--calibration-degree", type=int, default=1, choices=(1, 2, 3), help="1 fits an affine mapping, 2 and 3 a polynomial")
+    parser.add_argument("--synchronous", type=float, metavar="DELTA", help="Runs the simulation in synchronous mode with this fixed step (s), ticked in real time")
+    parser.add_argument("--latency", action="store_true", help="Measures the latency of every stage, shows it below the status text and writes it on exit")
+    parser.add_argument("--profiler", action="store_true", help="Samples all threads and records the time of every stage into Profile_*.collapsed and Profile_*.trace.json")
+    args = parser.parse_args()
+    if args.calibrate and args.headless:
+        parser.error("--calibrate needs the calibration window, it can not be used with --headless")
+
+    # Define inital value basic variables
+    tracking_data = "Null", "Null", "Null", "Null", "Null", "Null"
+    latest_sample = LatestSample(GazeSample(0.0, tracking_data, "Null", "Null", "Null", "Null"))   # Newest gaze sample from the acquisition thread
+    section_amount = 16
+
+    # Target rate of the Eye Tracker readout, the window redraw follows the monitor (display_rate below)
+    tracker_rate = args.tracker_rate # Hz
+
+    text_refresh_rate = 10 # Hz
+    marker_trail_length = 10 # Samples
+
+    # Camera windows, headless recordings switch both off and nothing is rendered
+    show_segmentation_camera = not args.headless
+    show_rgb_camera = not args.headless
+    camera_display_rate = 30 # Hz
+
+    # Tag and instance are voted within this radius around the gaze point, scaled up with lower tracking confidence
+    gaze_vote_radius = 30 # px
+
+    # Screen pixels per pixel of the segmentation camera, see "benchmark.py scale" for the cost and the accuracy
+    segmentation_scale = args.segmentation_scale
+
+    # Every segmentation frame is joined with the gaze sample of its timestamp instead of the newest sample
+    join_gaze_and_frames = True
+    fixed_delta = args.synchronous # s, None runs the simulation asynchronously
+
+    # Gaze source, simulator and screen, the resolution is queried once and handed to all classes
+    if args.fake:
+        screen_width, screen_height = (int(value) for value in args.screen_size.split("x"))
+        gaze_source = SyntheticGazeSource((screen_width, screen_height), rate=tracker_rate, noise=args.gaze_noise, seed=args.seed)
+        display_metrics = FixedDisplayMetrics(screen_width, screen_height, gaze_source.cursor_position)
+        simulator = FakeSimulator(seed=args.seed)
+    else:
+        gaze_source = TrackerClient()
+        display_metrics = Win32DisplayMetrics()
+        simulator = CarlaSimulator()
+    screen_width, screen_height = display_metrics.screen_size()
+    display_rate = args.display_rate or display_metrics.refresh_rate() # Hz, a hard-coded 60 Hz would lag on 120 and 144 Hz monitors
+
+    # Runs calibration and returns pixel of the buttons and the tracker values
+    #calibration = Calibration(gaze_source, display_metrics)
+    #calibration_txt = calibration.calibration()
+
+    # Latency from the gaze sample to the label and to the overlay, only measured on request
+    latency_monitor = LatencyMonitor() if args.latency else None
+    # Stage times and stack samples of all threads, to find out afterwards which part made the overlay stutter
+    profiler = Profiler() if args.profiler else None
+
+    # Logging, the recording stores every computed value. The CSV log doubles the disk writes and is only written on
+    # request, export_recording.py converts a recording into the same format afterwards
+    write_csv_log = args.csv_log
+    write_recording = True
+    record_segmentation_frames = args.record_frames    # Frames are stored uncompressed, about 4 MB/s at 1920x1080 and scale 10
+    logger = csv_Logger() if write_csv_log else None
+
+    # Fixations and the dwell per tag and instance are detected while driving and written at the end. The dispersion
+    # criterion does not depend on the sample rate, the velocity criterion ("ivt") is easily broken up by tracker noise
+    fixation_detector = FixationDetector("idt")
+
+    # Where the driver looked, in 20 px bins without decay, written at the end as image and array
+    attention_map_bin_size = 20 # px
+    attention_map_half_life = None # s
+
+    # Start required classes
+    eye_tracker = EyeTracker(gaze_source)
+    # Areas of interest such as mirrors and dashboard, defined in screen pixels as described in AOIRegistry.load
+    aoi_layout = "aois.json"
+    aoi_registry = AOIRegistry.load(aoi_layout) if os.path.exists(aoi_layout) else None
+    look_direction = LookDirection(screen_width, screen_height, aoi_registry)
+    frame_display = FrameDisplay(camera_display_rate) if show_segmentation_camera or show_rgb_camera else None
+    carla_client = CarlaClient(frame_display, show_segmentation_camera, show_rgb_camera, vote_radius=gaze_vote_radius, confidence_scaled_radius=True, simulator=simulator, screen_size=(screen_width, screen_height), segmentation_scale=segmentation_scale)
+    carla_client.latency_monitor = latency_monitor
+    carla_client.profiler = profiler
+    carla_client.record_frames = record_segmentation_frames
+    gaze_join = GazeFrameJoin() if join_gaze_and_frames else None
+    carla_client.gaze_join = gaze_join
+    if logger is not None:
+        logger.profiler = profiler
+    if frame_display is not None:
+        frame_display.profiler = profiler
+    correct_curvature = CorrectCurvature(screen_width=screen_width)
+    attention_map = AttentionMap(screen_width, screen_height, attention_map_bin_size, attention_map_half_life, section_amount)
+    gaze_filter = GazeFilter() if args.smooth else None
+
+    # Coefficients fitted with fit_curvature.py replace the built-in ones. The synthetic gaze source emits the true target,
+    # so with --fake the correction is the identity (V-function without slope and offset) and no profile is loaded
+    curvature_profile = "curvature_profile.json"
+    if args.fake:
+        correct_curvature.c = correct_curvature.d = correct_curvature.c2 = correct_curvature.d2 = 0.0
+    elif os.path.exists(curvature_profile):
+        correct_curvature.load_profile(curvature_profile)
+
+    # Least-squares calibration on a grid of targets on top of the curvature correction. The profile is kept per user and
+    # resolution, so later sessions load it instead of calibrating. Without a profile only the curvature is corrected
+    calibration_columns, calibration_rows = (int(value) for value in args.calibration_grid.split("x"))
+    calibration_samples = 30 # Samples per target
+    calibration_profile = CalibrationMapping.profile_filename(args.user, screen_width, screen_height)
+    gaze_correction = correct_curvature
+    if args.calibrate:
+        calibration_result = Calibration(gaze_source, display_metrics).calibrate_grid(calibration_columns, calibration_rows, calibration_samples, rate=tracker_rate)
+        if isinstance(calibration_result, tuple):
+            calibration_mapping = CalibrationMapping(correct_curvature, screen_width, screen_height, args.calibration_degree)
+            # Targets without samples (gaze lost until the timeout) can leave too few targets for the fit
+            try:
+                calibration_report = calibration_mapping.fit(*calibration_result)
+            except ValueError as error:
+                print(f"Calibration not done: {error}")
+            else:
+                calibration_mapping.save_profile(calibration_profile, {"user": args.user, "created": time.strftime("%Y-%m-%d %H:%M:%S"), "residuals": calibration_report})
+                print(f"Calibration on {len(calibration_result[0])} targets: RMS error {calibration_report['all']['rms error before']:.1f} px -> {calibration_report['all']['rms error']:.1f} px, written to {calibration_profile}")
+                gaze_correction = calibration_mapping
+        else:
+            print(f"Calibration not done: {calibration_result or 'aborted'}")
+    elif not args.fake and os.path.exists(calibration_profile):
+        gaze_correction = CalibrationMapping.load_profile(calibration_profile, correct_curvature)
+        print(f"Calibration profile {calibration_profile} loaded")
+    if gaze_correction is not correct_curvature:
+        table_start = time.perf_counter()
+        gaze_correction.build_table()
+        print(f"Correction table built in {time.perf_counter() - table_start:.2f} s")
+
+    # Window to show the status text and the marker for the eye position
+    if not args.headless:
+        root = tk.Tk()
+        root.title("Eye Tracker")
+        root.geometry(f"{screen_width}x{screen_height}+0+0")
+        root.attributes('-alpha', 0.3)
+
+        # Marker and status text are drawn on one canvas that covers the whole window
+        overlay_canvas = tk.Canvas(root, width=screen_width, height=screen_height, highlightthickness=0)
+        overlay_canvas.place(x=0, y=0)
+
+        text_manager = TextManager(text_refresh_rate, overlay_canvas, origin=((screen_width-700)//2, 0), latency_monitor=latency_monitor, show_aoi=aoi_registry is not None)
+        gaze_overlay = GazeOverlay(overlay_canvas, trail_length=marker_trail_length, confidence_colors=True)
+
+    # Start CARLA simulation as client
+    carla_client.connect_to_server("localhost")
+    if fixed_delta is not None:
+        simulator.set_synchronous(fixed_delta)
+    sensor = carla_client.example_situation()
+    # Callback function to acquire instances of the segmentation
+    sensor[0].listen(lambda image: carla_client.process_segmentation_image(image, latest_sample.get()))
+
+    # Callback function to show the rgb image
+    if sensor[1] is not None:
+        sensor[1].listen(lambda image: carla_client.process_rgb_image(image))
+
+    if frame_display is not None:
+        frame_display.start()
+
+    recorder = None
+    if write_recording:
+        recorder_metadata = {"screen_width": screen_width, "screen_height": screen_height, "tracker_rate": tracker_rate, "section_amount": section_amount}
+        if gaze_filter is not None:
+            recorder_metadata["gaze_filter"] = gaze_filter.settings()
+        if aoi_registry is not None:
+            recorder_metadata["aois"] = [aoi.name for aoi in aoi_registry.aois]
+        recorder = GazeRecorder(metadata=recorder_metadata)
+        recorder.profiler = profiler
+    acquisition = AcquisitionThread(eye_tracker, gaze_correction, logger, latest_sample, tracker_rate, recorder, look_direction, section_amount, carla_client.latest_result, display_metrics.cursor_position, latency_monitor, fixation_detector, attention_map, gaze_filter)
+    acquisition.profiler = profiler
+    acquisition.gaze_join = gaze_join
+    acquisition.start()
+    ticker = None
+    if fixed_delta is not None:
+        ticker = SimulationTicker(simulator, fixed_delta, gaze_join)
+        ticker.start()
+    if profiler is not None:
+        profiler.start()
+    scheduler = FixedRateScheduler(display_rate)
+    start_time = time.perf_counter()
+
+    # The logger is closed in any case, so buffered rows are also written when the loop crashes
+    try:
+        drawn_sample = latest_sample.get()   # The placeholder sample is not drawn
+        while args.duration is None or time.perf_counter() - start_time < args.duration:
+            scheduler.wait()
+
+            if acquisition.error is not None:
+                raise RuntimeError("Acquisition thread stopped") from acquisition.error
+            if ticker is not None and ticker.error is not None:
+                raise RuntimeError("Simulation ticker stopped") from ticker.error
+            if args.headless:
+                continue
+
+            # Only the newest sample is drawn, samples in between are skipped by the window but not by the logger
+            sample = latest_sample.get()
+            drawn = sample is not drawn_sample
+            if drawn:
+                drawn_sample = sample
+                if latency_monitor is not None:
+                    draw_start = time.perf_counter()
+                tracking_data = sample.tracking_data
+
+                if profiler is not None:
+                    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                look_dir= look_direction.look_direction_rough(tracking_data)
+                look_coord = look_direction.look_direction_coordinates(tracking_data, section_amount)
+                text_manager.update_text(tracking_data, look_dir, look_coord, carla_client.latest_result.get(), look_direction.look_direction_aoi(tracking_data))
+                if profiler is not None:
+                    profiler.record("text update", wall_start, cpu_start)
+                    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+
+                gaze_overlay.draw(tracking_data)
+                if profiler is not None:
+                    profiler.record("overlay draw", wall_start, cpu_start)
+
+            if profiler is not None:
+                wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            root.update()
+            if profiler is not None:
+                profiler.record("Tk update", wall_start, cpu_start)
+            # The overlay is on screen once Tk has processed the changed items
+            if drawn and latency_monitor is not None:
+                drawn_time = time.perf_counter()
+                latency_monitor.record("overlay draw", drawn_time - draw_start)
+                latency_monitor.record("gaze to overlay", drawn_time - sample.timestamp)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        acquisition.stop()
+        if ticker is not None:
+            ticker.stop()
+        for camera in sensor:
+            if camera is not None:
+                camera.stop()
+        if carla_client.frame_recorder is not None:
+            carla_client.frame_recorder.close()
+            print(f"{carla_client.frame_recorder.records} segmentation frames written to {carla_client.frame_recorder.filename}")
+        # A server left in synchronous mode would wait for ticks that never come
+        if fixed_delta is not None:
+            simulator.set_synchronous(None)
+        if logger is not None:
+            logger.close()
+        if recorder is not None:
+            recorder.close()
+        fixation_detector.write()
+        attention_map_name = f"Attention_Map_{time.strftime('%Y%m%d_%H%M%S')}"
+        attention_map.save(attention_map_name + ".npy")
+        print(f"Attention map of {attention_map.samples} samples ({attention_map.outside} off screen) written to " + attention_map.save(attention_map_name + ".png"))
+        print(f"Fixations: {fixation_detector.fixation_count} with {fixation_detector.fixation_time:.1f} s, longest dwell: " + ", ".join(f"{instance} {dwell:.1f} s" for instance, dwell in fixation_detector.dwell_by_instance(5)))
+        elapsed = time.perf_counter() - start_time
+        print("Acquisition: " + acquisition.scheduler.stats() + f", {acquisition.scheduler.ticks / elapsed:.0f} samples/s")
+        print("Display: " + scheduler.stats() + ("" if args.headless else f", {gaze_overlay.redraws} overlay redraws"))
+        if gaze_filter is not None:
+            print(f"Gaze filter: {gaze_filter.stats()}, tracker period {1000/tracker_rate:.1f} ms")
+        if gaze_join is not None:
+            print("Gaze and frame join: " + gaze_join.stats())
+        if ticker is not None:
+            print("Simulation: " + ticker.scheduler.stats())
+        if frame_display is not None:
+            frame_display.stop()
+            print("Camera display: " + frame_display.stats())
+        if profiler is not None:
+            profiler.stop()
+            print("Profile:")
+            for line in profiler.summary():
+                print("  " + line)
+            print(f"Stack samples written to {profiler.collapsed_filename}, stage times to {profiler.trace_filename}")
+        if latency_monitor is not None:
+            print("Latency:")
+            for line in latency_monitor.summary():
+                print("  " + line)
+            latency_monitor.save(f"Latency_{time.strftime('%Y%m%d_%H%M%S')}.json")
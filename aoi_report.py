@@ -0,0 +1,36 @@
+import argparse
+import time
+
+import numpy as np
+
+from EyeTrackerv6 import AOIRegistry, BinaryRecording, csv_Logger
+
+
+# Counts how many corrected gaze samples of recorded sessions fall into every area of interest of an aois.json layout
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Share of the gaze samples per area of interest")
+    parser.add_argument("layout", help="Areas of interest as described in AOIRegistry.load, e.g. aois.json")
+    parser.add_argument("logs", nargs="+", help="Eye_Track_Log_*.csv or Eye_Track_Recording_*.eyerec files")
+    args = parser.parse_args()
+
+    registry = AOIRegistry.load(args.layout)
+    names = [aoi.name for aoi in registry.aois] + [str(registry.fallback) if registry.fallback is not None else "no area"]
+
+    for filename in args.logs:
+        if filename.endswith(".csv"):
+            header, columns = csv_Logger.read_log(filename)
+            x, y = columns["Adjusted x"], columns["Adjusted y"]
+        else:
+            header, records = BinaryRecording.load(filename)
+            x, y = records["adjusted_x"].astype(np.float64), records["adjusted_y"].astype(np.float64)
+
+        start = time.perf_counter()
+        indices = registry.hit_batch(x, y)
+        hit_time = time.perf_counter() - start
+
+        valid = ~(np.isnan(x) | np.isnan(y))
+        counts = np.bincount(indices[valid] % len(names), minlength=len(names))   # -1 (no area) is counted in the last entry
+        print(f"{filename}: {np.count_nonzero(valid)} samples with gaze, hit test {hit_time*1000:.1f} ms")
+        for name, count in zip(names, counts):
+            if count:
+                print(f"  {name:30} {count:10} {count / max(np.count_nonzero(valid), 1) * 100:6.1f} %")
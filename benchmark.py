@@ -0,0 +1,643 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+from EyeTrackerv6 import csv_Logger, CorrectCurvature, CalibrationMapping, Calibration, GazeFilter, CarlaClient, EyeTracker, LookDirection, AOIRegistry, TextManager, GazeSource, SyntheticGazeSource, GazeSample, GazeFrameJoin, SegmentationResult, SensorImage, FakeCameraSensor, SEMANTIC_TAGS
+
+
+# Logger as it was before the buffered writer: opens the file again for every row
+class LegacyCsvLogger:
+    def __init__(self):
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        self.filename = f"Eye_Track_Log_legacy_{timestamp}.csv"
+
+        with open(self.filename, mode="w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Cursor x", "Cursor y", "Beam Eye Pos. x", "Beam Eye Pos. y", "Adjusted x", "Adjusted y"])
+
+    def log_data(self, data):
+        with open(self.filename, mode="a", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(data)
+
+    def close(self):
+        pass
+
+
+# Gaze source that returns recorded samples over and over, so the benchmark does not measure the generator
+class RecordedGazeSource(GazeSource):
+    def __init__(self, samples):
+        self.connected = True
+        self.next_sample = itertools.cycle(samples).__next__
+
+    def get_screen_gaze_info(self):
+        return self.next_sample()
+
+
+# Canvas that accepts the calls of TextManager without drawing, so only the text manager itself is measured
+class NullCanvas:
+    def __init__(self):
+        self.items = 0
+        self.calls = 0
+
+    def create_text(self, *args, **kwargs):
+        self.items += 1
+        return self.items
+
+    create_oval = create_text
+    create_rectangle = create_text
+
+    def itemconfigure(self, item, **kwargs):
+        self.calls += 1
+
+    def coords(self, item, *args):
+        self.calls += 1
+
+
+# Synthetic gaze from SyntheticGazeSource, generated in order so every run gets the same samples
+def synthetic_gaze(screen_width, screen_height, samples, seed=0):
+    source = SyntheticGazeSource((screen_width, screen_height), rate=60, noise=40, lost_probability=0.02, seed=seed)
+    gaze = []
+    for i in range(samples):
+        source.next_sample()
+        gaze.append(source.gaze)
+    return gaze
+
+
+# Times function(*arguments) for all argument tuples of make_arguments() in batches of batch_size calls. The first round
+# warms up. Percentiles are taken over the time per call of every batch, so the timer overhead does not dominate calls
+# of a few hundred nanoseconds. Allocations are measured separately with tracemalloc, which slows the calls down
+def measure(function, make_arguments, rounds=3, batch_size=50, allocation_samples=200):
+    batch_times = []
+    total_time = 0
+    calls = 0
+    for round_index in range(rounds + 1):
+        arguments = make_arguments()
+        for first in range(0, len(arguments), batch_size):
+            batch = arguments[first:first+batch_size]
+            start = time.perf_counter_ns()
+            for call_arguments in batch:
+                function(*call_arguments)
+            elapsed = time.perf_counter_ns() - start
+            if round_index:
+                batch_times.append(elapsed / len(batch))
+                total_time += elapsed
+                calls += len(batch)
+
+    # Peak of the traced memory during one call above the memory before it, and blocks still allocated afterwards
+    arguments = make_arguments()[:allocation_samples]
+    allocated = []
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    for call_arguments in arguments:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function(*call_arguments)
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    retained_blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(batch_times, (50, 95, 99))
+    return {
+        "calls": calls,
+        "ns/op": total_time / calls,
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "alloc bytes/op": float(np.mean(allocated)),
+        "retained blocks/op": retained_blocks / len(arguments)
+    }
+
+
+def benchmark_tracker(gaze, rounds):
+    eye_tracker = EyeTracker(RecordedGazeSource(gaze))
+    return {"EyeTracker.get_trackingdata": measure(eye_tracker.get_trackingdata, lambda: [()] * len(gaze), rounds)}
+
+
+# Checks that the lookup table gives exactly the same result as the V-function for every column and some off-screen values
+def check_curvature_table(screen_width):
+    table_correction = CorrectCurvature(use_table=True, screen_width=screen_width)
+    formula_correction = CorrectCurvature(use_table=False, screen_width=screen_width)
+
+    values = list(range(-200, screen_width + 200)) + [x + 0.5 for x in range(-10, screen_width + 10, 7)] + [float(x) for x in range(0, screen_width, 13)]
+    mismatches = []
+    for x in values:
+        from_table = table_correction.correct(["Tracker connected", False, None, None, x, 0])[4]
+        from_formula = formula_correction.correct(["Tracker connected", False, None, None, x, 0])[4]
+        if from_table != from_formula or type(from_table) is not type(from_formula):
+            mismatches.append((x, from_table, from_formula))
+    return len(values), mismatches
+
+
+# correct() changes the list it gets, so every round gets fresh tracking data
+def benchmark_curvature(gaze, screen_width, rounds):
+    tracking_data = [["Tracker connected", item.is_lost, item.confidence, None, item.x, item.y] for item in gaze]
+    results = {}
+    for name, use_table in (("CorrectCurvature.correct (V-function)", False), ("CorrectCurvature.correct", True)):
+        correction = CorrectCurvature(use_table=use_table, screen_width=screen_width)
+        correction.correct(list(tracking_data[0]))  # Builds the table before the measurement
+        results[name] = measure(correction.correct, lambda: [(list(data),) for data in tracking_data], rounds)
+    return results
+
+
+# Raw gaze of a tracker that is off by a scaled, shifted and slightly bent mapping, with noise and glances elsewhere.
+# The curvature correction is switched off (d = d2 = 0), so the fit has to find the inverse of this mapping
+def synthetic_calibration(screen_width, screen_height, targets, samples_per_target, noise=10, outliers=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    samples = []
+    for x, y in targets:
+        u, v = x / screen_width, y / screen_height
+        raw_x = 40 + 0.94*x + 0.02*y + 60*u*v + rng.normal(0, noise, samples_per_target)
+        raw_y = -25 + 1.05*y - 50*u*u + rng.normal(0, noise, samples_per_target)
+        glances = rng.random(samples_per_target) < outliers
+        raw_x[glances] = rng.uniform(0, screen_width, np.count_nonzero(glances))
+        raw_y[glances] = rng.uniform(0, screen_height, np.count_nonzero(glances))
+        samples.append(np.column_stack((raw_x, raw_y)))
+    return samples
+
+
+# Fits the calibration on a grid and measures the error on a denser grid of test points, compares table and calculation
+def check_calibration(screen_width, screen_height, degree, samples_per_target=30):
+    correct_curvature = CorrectCurvature(screen_width=screen_width)
+    correct_curvature.d = correct_curvature.d2 = 0.0
+    targets = Calibration.grid_targets(screen_width, screen_height, 3, 3) if degree == 1 else Calibration.grid_targets(screen_width, screen_height, 4, 4)
+    mapping = CalibrationMapping(correct_curvature, screen_width, screen_height, degree)
+    start = time.perf_counter()
+    report = mapping.fit(targets, synthetic_calibration(screen_width, screen_height, targets, samples_per_target))
+    fit_time = time.perf_counter() - start
+
+    test_targets = Calibration.grid_targets(screen_width, screen_height, 15, 9, margin=0.05)
+    test_samples = synthetic_calibration(screen_width, screen_height, test_targets, 1, noise=0, outliers=0, seed=1)
+    raw = np.concatenate(test_samples)
+    mapped_x, mapped_y = mapping.correct_batch(raw[:, 0], raw[:, 1])
+    test_targets = np.array(test_targets, dtype=np.float64)
+    test_error = np.hypot(mapped_x - test_targets[:, 0], mapped_y - test_targets[:, 1])
+    raw_error = np.hypot(raw[:, 0] - test_targets[:, 0], raw[:, 1] - test_targets[:, 1])
+
+    start = time.perf_counter()
+    mapping.build_table()
+    table_time = time.perf_counter() - start
+
+    calculated = CalibrationMapping(correct_curvature, screen_width, screen_height, degree, use_table=False)
+    calculated.coefficients = mapping.coefficients
+    rng = np.random.default_rng(2)
+    points = [(int(x), int(y)) for x, y in zip(rng.integers(0, screen_width + 1, 20000), rng.integers(0, screen_height + 1, 20000))]
+    points += [(0, 0), (screen_width, screen_height), (screen_width // 2, 0), (0, screen_height)]
+    mismatches = [(x, y) for x, y in points if mapping.correct(["Tracker connected", False, None, None, x, y])[4:] != calculated.correct(["Tracker connected", False, None, None, x, y])[4:]]
+    return mapping, {
+        "targets": len(targets),
+        "rejected": report["all"]["rejected"],
+        "fit ms": fit_time * 1000,
+        "table ms": table_time * 1000,
+        "raw error px": float(np.mean(raw_error)),
+        "test error px": float(np.mean(test_error)),
+        "max test error px": float(np.max(test_error)),
+        "checked": len(points),
+        "mismatches": len(mismatches)
+    }
+
+
+def benchmark_calibration(gaze, screen_width, screen_height, rounds):
+    results = {}
+    accuracy = {}
+    tracking_data = [["Tracker connected", item.is_lost, item.confidence, None, round(item.x), round(item.y)] for item in gaze]
+    for degree in (1, 2):
+        mapping, accuracy[f"CalibrationMapping degree {degree}"] = check_calibration(screen_width, screen_height, degree)
+        results[f"CalibrationMapping.correct (degree {degree})"] = measure(mapping.correct, lambda: [(list(data),) for data in tracking_data], rounds)
+    return results, accuracy
+
+
+# filter() changes the list it gets like correct(), the timestamps are evenly spaced at 30 Hz
+def benchmark_filter(gaze, rounds):
+    tracking_data = [["Tracker connected", item.is_lost, item.confidence, None, item.x, item.y] for item in gaze]
+    gaze_filter = GazeFilter()
+    return {"GazeFilter.filter": measure(gaze_filter.filter, lambda: [(list(data), i/30) for i, data in enumerate(tracking_data)], rounds)}, gaze_filter
+
+
+# Frames every 20 ms of simulation time whose delivery is delayed, joined with the 60 Hz gaze either by taking the newest
+# sample when the frame arrives (as before the join) or by GazeFrameJoin. The simulation runs at speed times the wall
+# clock. The error is the distance to the gaze at the moment the frame shows, interpolated from all samples, and the
+# staleness the time between that moment and the sample that was used
+def join_case(samples, speed, delays, ticks=False, frame_interval=0.02):
+    timestamps = np.array([sample.timestamp for sample in samples])
+    true_x = np.array([sample.x for sample in samples], dtype=np.float64)
+    true_y = np.array([sample.y for sample in samples], dtype=np.float64)
+
+    sim_times = np.arange(1, int(timestamps[-1] * speed / frame_interval)) * frame_interval
+    frame_times = sim_times / speed
+    arrivals = frame_times + delays(len(frame_times))
+    order = np.argsort(arrivals, kind="stable")
+
+    gaze_join = GazeFrameJoin()
+    errors = {"newest sample": [], "GazeFrameJoin": []}
+    staleness = {"newest sample": [], "GazeFrameJoin": []}
+    next_sample = 0
+    for index in order:
+        arrival = arrivals[index]
+        while next_sample < len(samples) and samples[next_sample].timestamp <= arrival:
+            gaze_join.add_sample(samples[next_sample])
+            next_sample += 1
+        reference_x = np.interp(frame_times[index], timestamps, true_x)
+        reference_y = np.interp(frame_times[index], timestamps, true_y)
+        newest = samples[next_sample - 1]
+        if ticks:
+            gaze_join.add_tick(int(index), float(frame_times[index]))
+        joined, skew = gaze_join.join(SensorImage(None, 0, 0, int(index), float(sim_times[index])), float(arrival))
+        for name, sample in (("newest sample", newest), ("GazeFrameJoin", joined)):
+            errors[name].append(math.hypot(sample.x - reference_x, sample.y - reference_y))
+            staleness[name].append(abs(sample.timestamp - frame_times[index]))
+
+    accuracy = {name: {
+        "mean error px": float(np.mean(errors[name])),
+        "p95 error px": float(np.percentile(errors[name], 95)),
+        "mean staleness ms": float(np.mean(staleness[name])) * 1000
+    } for name in errors}
+    images = [(SensorImage(None, 0, 0, i, float(sim_times[i])), float(arrivals[i])) for i in range(len(frame_times))]
+    return gaze_join, accuracy, images
+
+
+# Delivery delayed like on a loaded machine at real-time speed, a simulation that runs slower than the wall clock with a
+# constant delay, where the clock mapping has to follow the drift, and a synchronous simulation with its tick times
+def benchmark_join(gaze, rounds, seed=0):
+    samples = [GazeSample(i / 60, ("Tracker connected", item.is_lost, item.confidence, None, round(item.x), round(item.y)), item.x, item.y, 0, 0) for i, item in enumerate(gaze)]
+    rng = np.random.default_rng(seed)
+    cases = {
+        "loaded, speed 1.0": (1.0, lambda count: 0.001 + rng.exponential(0.04, count), False),
+        "5 ms delay, speed 0.8": (0.8, lambda count: np.full(count, 0.005), False),
+        "5 ms delay, speed 0.5": (0.5, lambda count: np.full(count, 0.005), False),
+        "synchronous, 20 ms delay": (1.0, lambda count: np.full(count, 0.02), True)
+    }
+    results = {}
+    accuracy = {}
+    stats = {}
+    for case, (speed, delays, ticks) in cases.items():
+        gaze_join, case_accuracy, images = join_case(samples, speed, delays, ticks)
+        stats[case] = gaze_join.stats()
+        for name, values in case_accuracy.items():
+            accuracy[f"{case}, {name}"] = values
+        if not results:
+            results["GazeFrameJoin.join"] = measure(gaze_join.join, lambda: images, rounds)
+    return results, accuracy, stats
+
+
+def benchmark_look_direction(gaze, screen_width, screen_height, rounds):
+    look_direction = LookDirection(screen_width, screen_height)
+    tracking_data = [(["Tracker connected", item.is_lost, item.confidence, None, item.x, item.y],) for item in gaze]
+    return {
+        "LookDirection.look_direction_rough": measure(look_direction.look_direction_rough, lambda: tracking_data, rounds),
+        "LookDirection.look_direction_coordinates": measure(look_direction.look_direction_coordinates, lambda: [(data[0], 16) for data in tracking_data], rounds)
+    }
+
+
+# Checks that the quadrant and grid registries give the same results as LookDirection, on and around the screen and
+# exactly on the edges between the areas
+def check_aoi_registry(screen_width, screen_height, section_amount=16):
+    look_direction = LookDirection(screen_width, screen_height)
+    quadrants = AOIRegistry.quadrants(screen_width, screen_height)
+    grid = AOIRegistry.grid(screen_width, screen_height, section_amount)
+    sections = int(section_amount ** 0.5)
+    edges_x = [i * screen_width / sections for i in range(sections + 1)] + [screen_width / 2]
+    edges_y = [i * screen_height / sections for i in range(sections + 1)] + [screen_height / 2]
+    xs = sorted(set(list(range(-50, screen_width + 50, 7)) + [x + offset for x in edges_x for offset in (-1, -0.5, 0, 0.5, 1)]))
+    ys = sorted(set(list(range(-50, screen_height + 50, 7)) + [y + offset for y in edges_y for offset in (-1, -0.5, 0, 0.5, 1)]))
+
+    mismatches = []
+    checked = 0
+    points_x, points_y = [], []
+    for y in ys:
+        for x in xs:
+            tracking_data = ["Tracker connected", False, None, None, x, y]
+            checked += 1
+            points_x.append(x)
+            points_y.append(y)
+            if quadrants.hit(x, y) != look_direction.look_direction_index(tracking_data):
+                mismatches.append(("quadrant", x, y))
+            # Left of and above the screen LookDirection returns negative cells, which the grid has no areas for
+            if x >= 0 and y >= 0 and grid.hit(x, y) != look_direction.look_direction_coordinates(tracking_data, section_amount):
+                mismatches.append(("grid", x, y))
+
+    batch = quadrants.values(quadrants.hit_batch(points_x, points_y))
+    mismatches += [("quadrant batch", x, y) for x, y, value in zip(points_x, points_y, batch) if value != quadrants.hit(x, y)]
+    batch = grid.values(grid.hit_batch(points_x, points_y))
+    mismatches += [("grid batch", x, y) for x, y, value in zip(points_x, points_y, batch) if value != grid.hit(x, y)]
+    return checked, mismatches
+
+
+# Registry with count random rectangles and polygons on two monitors side by side
+def random_aoi_registry(screen_width, screen_height, count, seed=0):
+    rng = np.random.default_rng(seed)
+    registry = AOIRegistry()
+    registry.add_monitor("left", 0, 0, screen_width, screen_height)
+    registry.add_monitor("right", screen_width, 0, screen_width, screen_height)
+    for i in range(count):
+        monitor = ("left", "right")[i % 2]
+        x, y = rng.uniform(0, screen_width), rng.uniform(0, screen_height)
+        size = rng.uniform(20, 300)
+        if i % 3:
+            registry.add_rect(f"rect {i}", x, y, x + size, y + size/2, monitor)
+        else:
+            registry.add_polygon(f"polygon {i}", [(x, y), (x + size, y + size/3), (x + size/2, y + size)], monitor)
+    return registry
+
+
+# Cost of a hit test for a growing number of areas, one point at a time and for whole arrays
+def benchmark_aoi(gaze, screen_width, screen_height, rounds):
+    points = [(item.x, item.y) for item in gaze]
+    x = np.array([point[0] for point in points], dtype=np.float64)
+    y = np.array([point[1] for point in points], dtype=np.float64)
+    results = {}
+    for count in (4, 64, 1024):
+        registry = random_aoi_registry(screen_width, screen_height, count)
+        registry.build()
+        results[f"AOIRegistry.hit {count} areas"] = measure(registry.hit, lambda: points, rounds)
+        batch = registry.hit_batch(x, y)
+        if any(batch[i] != registry.hit_index(*points[i]) for i in range(0, len(points), 7)):
+            raise SystemExit(f"hit_batch differs from hit_index with {count} areas")
+        results[f"AOIRegistry.hit_batch {count} areas (per point)"] = measure(lambda: registry.hit_batch(x, y), lambda: [()] * 5, rounds, batch_size=1, allocation_samples=2)
+        for name in ("ns/op", "p50", "p95", "p99"):
+            results[f"AOIRegistry.hit_batch {count} areas (per point)"][name] /= len(points)
+    return results
+
+
+# Instance lookup as it was before the direct byte lookup: converts the whole frame and builds the tag mapping every time
+def legacy_lookup_instance(image, column, row):
+    array = np.frombuffer(image.raw_data, dtype=np.uint8)
+    array = np.reshape(array, (image.height, image.width, 4))
+    b, g, r = array[row, column, 0], array[row, column, 1], array[row, column, 2]
+    red_to_tag_mapping = dict(enumerate(SEMANTIC_TAGS))
+    return red_to_tag_mapping.get(r, "Unknown"), str(g) + "-" + str(b)
+
+
+# Segmentation image with random tags and instance ids in 8x8 pixel blocks, raw_data is a memoryview like in CARLA
+def synthetic_segmentation_image(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, size=((height + 7)//8, (width + 7)//8, 4), dtype=np.uint8)
+    blocks[:, :, 2] %= len(SEMANTIC_TAGS)
+    blocks[:, :, 3] = 255
+    array = np.ascontiguousarray(np.repeat(np.repeat(blocks, 8, axis=0), 8, axis=1)[:height, :width])
+    return types.SimpleNamespace(raw_data=memoryview(array.tobytes()), width=width, height=height, frame=0, timestamp=0.0)
+
+
+# Lookups of one frame size: the legacy lookup, the direct lookup and the callback with and without the majority vote
+def benchmark_segmentation(gaze, screen_width, screen_height, scale, lookups, rounds):
+    width, height = screen_width // scale, screen_height // scale
+    image = synthetic_segmentation_image(width, height)
+    points = [(min(max(item.x // scale, 0), width-1), min(max(item.y // scale, 0), height-1)) for item in gaze[:lookups]]
+
+    for column, row in points[:1000]:
+        if legacy_lookup_instance(image, column, row) != CarlaClient.lookup_instance(image, column, row):
+            raise SystemExit(f"Lookup differs from the legacy lookup at ({column}, {row})")
+
+    samples = [(image, GazeSample(0.0, ["Tracker connected", item.is_lost, item.confidence, None, item.x, item.y], item.x, item.y, item.x, item.y)) for item in gaze[:lookups]]
+    results = {
+        f"legacy lookup_instance {width}x{height}": measure(legacy_lookup_instance, lambda: [(image, column, row) for column, row in points], rounds),
+        f"CarlaClient.lookup_instance {width}x{height}": measure(CarlaClient.lookup_instance, lambda: [(image, column, row) for column, row in points], rounds)
+    }
+    for vote_radius in (0, 30):
+        carla_client = CarlaClient(vote_radius=vote_radius, confidence_scaled_radius=True, screen_size=(screen_width, screen_height), segmentation_scale=scale)
+        results[f"CarlaClient.process_segmentation_image {width}x{height} r={vote_radius}"] = measure(carla_client.process_segmentation_image, lambda: samples, rounds)
+    return results
+
+
+# Frame of a camera with a lower resolution: every pixel takes the value at its centre in the full resolution frame
+def downscaled_image(image, width, height):
+    array = np.frombuffer(image.raw_data, dtype=np.uint8).reshape(image.height, image.width, 4)
+    rows = ((np.arange(height) + 0.5) * image.height / height).astype(int)
+    columns = ((np.arange(width) + 0.5) * image.width / width).astype(int)
+    scaled = np.ascontiguousarray(array[rows][:, columns])
+    return SensorImage(memoryview(scaled).cast("B"), width, height, image.frame, image.timestamp)
+
+
+# Cost and accuracy of the segmentation camera resolution. The full resolution frame of a scene with many cars is the ground
+# truth, a lookup is counted as right if tag and instance id match the pixel under the gaze point in that frame
+def benchmark_segmentation_scale(screen_width, screen_height, scales, lookups, rounds):
+    truth = FakeCameraSensor(screen_width, screen_height, cars=40, seed=3).render(50)
+    rng = np.random.default_rng(2)
+    points = list(zip(rng.integers(0, screen_width, lookups).tolist(), rng.integers(0, screen_height, lookups).tolist()))
+    expected = [CarlaClient.lookup_instance(truth, x, y) for x, y in points]
+    on_car = [tag == "Car" for tag, instance_id in expected]
+    samples = [GazeSample(0.0, ("Tracker connected", False, None, None, x, y), x, y, x, y) for x, y in points]
+
+    results = {}
+    accuracy = {}
+    for scale in scales:
+        width, height = max(round(screen_width/scale), 1), max(round(screen_height/scale), 1)
+        image = downscaled_image(truth, width, height)
+        for vote_radius in (0, 30):
+            carla_client = CarlaClient(vote_radius=vote_radius, screen_size=(screen_width, screen_height), segmentation_scale=scale)
+            name = f"process_segmentation_image scale={scale:g} r={vote_radius}"
+            results[name] = measure(carla_client.process_segmentation_image, lambda: [(image, sample) for sample in samples], rounds)
+
+            right = []
+            for sample, (tag, instance_id) in zip(samples, expected):
+                carla_client.process_segmentation_image(image, sample)
+                result = carla_client.latest_result.get()
+                right.append(result.tag == tag and result.instance_id == instance_id)
+            right = np.array(right)
+            accuracy[name] = {
+                "frame": f"{width}x{height}",
+                "bytes/frame": width*height*4,
+                "accuracy": float(right.mean()),
+                "accuracy on cars": float(right[np.array(on_car)].mean()) if any(on_car) else None
+            }
+    return results, accuracy
+
+
+# Rows per second the caller can hand to the logger, and including writing everything to disk
+def logger_throughput(logger_class, rows):
+    logger = logger_class()
+    start = time.perf_counter()
+    for i in range(rows):
+        logger.log_data([960, 540, 900 + i % 100, 500 + i % 50, 910 + i % 100, 500 + i % 50])
+    log_time = time.perf_counter() - start
+    logger.close()
+    total_time = time.perf_counter() - start
+    return rows / log_time, rows / total_time
+
+
+# The loggers write into a temporary directory that is removed afterwards
+def benchmark_logger(gaze, rows, rounds):
+    data = [([item.x, item.y, item.x, item.y, item.x + 10, item.y],) for item in gaze[:rows]]
+    results = {}
+    throughput = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            for name, logger_class in (("legacy csv_Logger.log_data", LegacyCsvLogger), ("csv_Logger.log_data", csv_Logger)):
+                logger = logger_class()
+                try:
+                    results[name] = measure(logger.log_data, lambda: data, rounds)
+                finally:
+                    logger.close()
+                throughput[name] = logger_throughput(logger_class, len(data))
+        finally:
+            os.chdir(cwd)
+    return results, throughput
+
+
+# Every call refreshes the text, the gaze changes on every sample and the segmentation result every few samples
+def benchmark_text(gaze, screen_width, screen_height, rounds):
+    look_direction = LookDirection(screen_width, screen_height)
+    text_manager = TextManager(float("inf"), NullCanvas())
+    arguments = []
+    for i, item in enumerate(gaze):
+        tracking_data = ["Tracker connected", item.is_lost, item.confidence, EyeTracker.confidence_color(item.confidence), item.x, item.y]
+        result = SegmentationResult(SEMANTIC_TAGS[(i // 5) % len(SEMANTIC_TAGS)], f"{i // 256 % 256}-{i // 5 % 256}", 0.0, i // 5, 0.0)
+        arguments.append((tracking_data, look_direction.look_direction_rough(tracking_data), look_direction.look_direction_coordinates(tracking_data, 16), result))
+    return {"TextManager.update_text": measure(text_manager.update_text, lambda: arguments, rounds)}
+
+
+# Prints the ratio new/old of every benchmark that is in both result files, returns the names that got slower than threshold
+def compare(old, new, threshold):
+    print(f"{'benchmark':58} {'old ns/op':>10} {'new ns/op':>10} {'ratio':>7} {'p99 ratio':>9}")
+    regressions = []
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        ratio = result["ns/op"] / old["results"][name]["ns/op"]
+        p99_ratio = result["p99"] / old["results"][name]["p99"]
+        marker = " <-" if ratio > threshold else ""
+        print(f"{name:58} {old['results'][name]['ns/op']:10.0f} {result['ns/op']:10.0f} {ratio:7.2f} {p99_ratio:9.2f}{marker}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def print_results(results):
+    print(f"{'benchmark':58} {'ns/op':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'alloc B/op':>10} {'blocks/op':>9}")
+    for name, result in results.items():
+        print(f"{name:58} {result['ns/op']:9.0f} {result['p50']:9.0f} {result['p95']:9.0f} {result['p99']:9.0f} {result['alloc bytes/op']:10.0f} {result['retained blocks/op']:9.2f}")
+
+
+# Runs the hot paths against synthetic gaze and segmentation frames, the results can be saved and compared with an older run.
+# EyeTracker v4.5.py starts its main loop on import, so its logger and instance lookup are measured as the legacy entries
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the Eye Tracker hot paths")
+    parser.add_argument("benchmarks", nargs="*", default=["tracker", "curvature", "calibration", "filter", "join", "lookdirection", "aoi", "segmentation", "scale", "logger", "text"], help="Benchmarks to run (tracker, curvature, calibration, filter, join, lookdirection, aoi, segmentation, scale, logger, text)")
+    parser.add_argument("--samples", type=int, default=20000, help="Gaze samples per benchmark round")
+    parser.add_argument("--lookups", type=int, default=2000, help="Lookups per segmentation benchmark round")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows per logger benchmark round")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 2, 4, 10, 20], help="Segmentation camera scales of the scale benchmark")
+    parser.add_argument("--rounds", type=int, default=3, help="Measured rounds after the warm-up round")
+    parser.add_argument("--screen-width", type=int, default=3840, help="Screen width of the synthetic gaze and frames")
+    parser.add_argument("--screen-height", type=int, default=2160, help="Screen height of the synthetic gaze and frames")
+    parser.add_argument("--label", default="EyeTrackerv6", help="Name of this run in the result file")
+    parser.add_argument("--output", help="Writes the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compares two result files instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=1.1, help="Ratio new/old above which --compare reports a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as file:
+            old = json.load(file)
+        with open(args.compare[1]) as file:
+            new = json.load(file)
+        print(f"{old['label']} ({old['created']}) -> {new['label']} ({new['created']})")
+        regressions = compare(old, new, args.threshold)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} benchmarks are more than {args.threshold:.2f} times slower")
+        raise SystemExit(0)
+
+    gaze = synthetic_gaze(args.screen_width, args.screen_height, max(args.samples, args.lookups, args.rows))
+    results = {}
+    extra = {}
+
+    if "tracker" in args.benchmarks:
+        results.update(benchmark_tracker(gaze[:args.samples], args.rounds))
+
+    if "curvature" in args.benchmarks:
+        checked, mismatches = check_curvature_table(args.screen_width)
+        for x, from_table, from_formula in mismatches[:10]:
+            print(f"Mismatch at x = {x}: table {from_table}, formula {from_formula}")
+        if mismatches:
+            raise SystemExit(f"Lookup table differs from the V-function for {len(mismatches)} of {checked} values")
+        print(f"Lookup table matches the V-function for all {checked} checked values")
+        results.update(benchmark_curvature(gaze[:args.samples], args.screen_width, args.rounds))
+
+    if "calibration" in args.benchmarks:
+        calibration_results, accuracy = benchmark_calibration(gaze[:args.samples], args.screen_width, args.screen_height, args.rounds)
+        for name, values in accuracy.items():
+            print(f"{name}: {values['targets']} targets, {values['rejected']} outliers rejected, fit {values['fit ms']:.1f} ms, table {values['table ms']:.0f} ms, error {values['raw error px']:.1f} px -> {values['test error px']:.1f} px (max {values['max test error px']:.1f} px)")
+            if values["mismatches"]:
+                raise SystemExit(f"{name}: table differs from the calculation for {values['mismatches']} of {values['checked']} pixels")
+            extra[name] = values
+        print(f"Calibration tables match the calculation for all {values['checked']} checked pixels")
+        results.update(calibration_results)
+
+    if "filter" in args.benchmarks:
+        filter_results, gaze_filter = benchmark_filter(gaze[:args.samples], args.rounds)
+        results.update(filter_results)
+        print(f"Gaze filter at 30 Hz: {gaze_filter.stats()}")
+        extra["GazeFilter.filter"] = {"lag ms": gaze_filter.lag / gaze_filter.samples * 1000}
+
+    if "join" in args.benchmarks:
+        join_results, accuracy, join_stats = benchmark_join(gaze[:args.samples], args.rounds)
+        results.update(join_results)
+        for name, values in accuracy.items():
+            print(f"Frames {name:39}: mean error {values['mean error px']:6.1f} px, p95 {values['p95 error px']:6.1f} px, stale {values['mean staleness ms']:6.1f} ms")
+            extra["join " + name] = values
+        for case, stats in join_stats.items():
+            print(f"GazeFrameJoin {case}: {stats}")
+
+    if "lookdirection" in args.benchmarks:
+        results.update(benchmark_look_direction(gaze[:args.samples], args.screen_width, args.screen_height, args.rounds))
+
+    if "aoi" in args.benchmarks:
+        checked, mismatches = check_aoi_registry(args.screen_width, args.screen_height)
+        for kind, x, y in mismatches[:10]:
+            print(f"Mismatch of the {kind} registry at ({x}, {y})")
+        if mismatches:
+            raise SystemExit(f"AOI registry differs from LookDirection for {len(mismatches)} of {checked} points")
+        print(f"Quadrant and grid registries match LookDirection for all {checked} checked points")
+        results.update(benchmark_aoi(gaze[:args.samples], args.screen_width, args.screen_height, args.rounds))
+
+    if "segmentation" in args.benchmarks:
+        for scale in (10, 1):
+            results.update(benchmark_segmentation(gaze, args.screen_width, args.screen_height, scale, args.lookups, args.rounds))
+
+    if "scale" in args.benchmarks:
+        scale_results, accuracy = benchmark_segmentation_scale(args.screen_width, args.screen_height, args.scales, args.lookups, args.rounds)
+        results.update(scale_results)
+        for name, values in accuracy.items():
+            on_cars = f"{values['accuracy on cars']*100:6.1f} %" if values["accuracy on cars"] is not None else "-"
+            print(f"{name:45} {values['frame']:>10} {values['bytes/frame']/1e6:7.2f} MB/frame {scale_results[name]['ns/op']:9.0f} ns/lookup  accuracy {values['accuracy']*100:6.1f} %, on cars {on_cars}")
+            extra[name] = values
+
+    if "logger" in args.benchmarks:
+        logger_results, throughput = benchmark_logger(gaze, args.rows, args.rounds)
+        results.update(logger_results)
+        for name, (caller_rate, total_rate) in throughput.items():
+            print(f"{name:30} {caller_rate:12.0f} rows/s on the caller thread {total_rate:12.0f} rows/s including flush")
+            extra[name] = {"rows/s": caller_rate, "rows/s including flush": total_rate}
+
+    if "text" in args.benchmarks:
+        results.update(benchmark_text(gaze[:args.samples], args.screen_width, args.screen_height, args.rounds))
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, mode="w") as file:
+            json.dump({
+                "label": args.label,
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": sys.version.split()[0],
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "screen": [args.screen_width, args.screen_height],
+                "samples": args.samples,
+                "results": results,
+                "throughput": extra
+            }, file, indent=4)
+        print(f"Results written to {args.output}")
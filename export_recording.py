@@ -0,0 +1,33 @@
+import argparse
+import os
+
+import numpy as np
+
+from EyeTrackerv6 import BinaryRecording, GazeRecorder, csv_Logger
+
+
+# Converts Eye_Track_Recording_*.eyerec files to CSV for tools that read the Eye_Track_Log_*.csv format
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports gaze recordings as CSV")
+    parser.add_argument("recordings", nargs="+", help="Eye_Track_Recording_*.eyerec files")
+    parser.add_argument("--all", action="store_true", help="Write every recorded field instead of the six csv_Logger columns")
+    parser.add_argument("--output-dir", help="Directory for the CSV files (default: next to the recording)")
+    parser.add_argument("--force", action="store_true", help="Overwrite existing CSV files")
+    args = parser.parse_args()
+
+    for filename in args.recordings:
+        header, records = BinaryRecording.load(filename)
+        if args.all:
+            names = list(records.dtype.names)
+            columns = {name: records[name].astype(np.float64) for name in names}
+        else:
+            names, columns = GazeRecorder.log_columns(records)
+
+        # The live session writes its own Eye_Track_Log_<timestamp>.csv, usually with the same timestamp, so exports get a suffix
+        base = os.path.splitext(os.path.basename(filename))[0].replace("Eye_Track_Recording_", "Eye_Track_Log_")
+        output_filename = os.path.join(args.output_dir or os.path.dirname(filename), base + ("_all.csv" if args.all else "_export.csv"))
+        if os.path.exists(output_filename) and not args.force:
+            print(f"{filename}: {output_filename} exists, skipped (--force overwrites it)")
+            continue
+        csv_Logger.write_log(output_filename, names, columns, fmt="%.15g" if args.all else "%.10g")
+        print(f"{filename} -> {output_filename}: {len(records)} records")
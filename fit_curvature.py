@@ -0,0 +1,52 @@
+import argparse
+import time
+
+from EyeTrackerv6 import CorrectCurvature, CurvatureFitter
+
+
+def print_residuals(title, report):
+    print(title)
+    for region, values in report.items():
+        print(f"  {region:10} {values['samples']:8} samples  mean |dx| {values['mean abs error x']:7.1f} px  rms dx {values['rms error x']:7.1f} px  rms {values['rms error']:7.1f} px")
+
+
+# Fits the V-function coefficients of CorrectCurvature to the cursor positions in Eye_Track_Log_*.csv files
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fits the curvature correction to recorded gaze logs")
+    parser.add_argument("logs", nargs="+", help="Eye_Track_Log_*.csv files, the cursor is taken as the point that was looked at")
+    parser.add_argument("--screen-width", type=int, required=True, help="Screen width in pixels during the recording")
+    parser.add_argument("--screen-height", type=int, required=True, help="Screen height in pixels during the recording")
+    parser.add_argument("--profile", help="Profile with the start coefficients (default: built-in coefficients)")
+    parser.add_argument("--output", default="curvature_profile.json", help="Profile file to write")
+    parser.add_argument("--max-error", type=float, help="Ignore samples further than this from the cursor (px)")
+    parser.add_argument("--sections", type=int, default=16, help="Number of screen regions in the residual report")
+    args = parser.parse_args()
+
+    correct_curvature = CorrectCurvature(screen_width=args.screen_width)
+    if args.profile:
+        correct_curvature.load_profile(args.profile)
+
+    fitter = CurvatureFitter(args.screen_width, args.screen_height, max_error=args.max_error)
+    samples = fitter.load_logs(args.logs)
+    print(f"{samples} samples from {len(args.logs)} logs")
+
+    before = fitter.residuals(correct_curvature, args.sections)
+    print_residuals("Residuals with the start coefficients:", before)
+
+    start = time.perf_counter()
+    coefficients = fitter.fit(correct_curvature)
+    fit_time = time.perf_counter() - start
+    for name, value in coefficients.items():
+        setattr(correct_curvature, name, value)
+
+    after = fitter.residuals(correct_curvature, args.sections)
+    print_residuals(f"Residuals with the fitted coefficients ({fit_time:.2f} s):", after)
+    print("Coefficients: " + ", ".join(f"{name} = {value:.6g}" for name, value in coefficients.items()))
+
+    correct_curvature.save_profile(args.output, {
+        "screen_height": args.screen_height,
+        "logs": args.logs,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "residuals": after
+    })
+    print(f"Profile written to {args.output}")
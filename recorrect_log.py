@@ -0,0 +1,33 @@
+import argparse
+import os
+import time
+
+from EyeTrackerv6 import CorrectCurvature, GazeFilter
+
+
+# Rewrites the "Adjusted x/y" columns of Eye_Track_Log_*.csv files with new curvature coefficients
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Applies the curvature correction again to recorded gaze logs")
+    parser.add_argument("logs", nargs="+", help="Eye_Track_Log_*.csv files")
+    parser.add_argument("--output-dir", help="Directory for the corrected logs (default: next to the input)")
+    parser.add_argument("--suffix", default="_recorrected", help="Appended to the file name of every corrected log")
+    parser.add_argument("--screen-width", type=int, help="Screen width in pixels during the recording (default: current screen)")
+    for name in CorrectCurvature.coefficient_names:
+        parser.add_argument("--" + name, type=float, help=f"Coefficient {name} of the V-function")
+    parser.add_argument("--smooth", action="store_true", help="Smooths the raw gaze with the One Euro filter before the correction")
+    parser.add_argument("--rate", type=float, default=30, help="Sample rate of the logs for --smooth (Hz)")
+    args = parser.parse_args()
+
+    correct_curvature = CorrectCurvature(screen_width=args.screen_width)
+    for name in CorrectCurvature.coefficient_names:
+        if getattr(args, name) is not None:
+            setattr(correct_curvature, name, getattr(args, name))
+
+    for filename in args.logs:
+        base, extension = os.path.splitext(os.path.basename(filename))
+        output_dir = args.output_dir or os.path.dirname(filename)
+        output_filename = os.path.join(output_dir, base + args.suffix + extension)
+
+        start = time.perf_counter()
+        rows = correct_curvature.correct_log(filename, output_filename, GazeFilter() if args.smooth else None, args.rate)
+        print(f"{filename} -> {output_filename}: {rows} rows in {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,72 @@
+import argparse
+
+from EyeTrackerv6 import BinaryRecording, CalibrationMapping, CarlaClient, CorrectCurvature, GazeFilter, GazeFrameJoin, GazeRecorder, LookDirection, ReplayEngine
+
+
+# Replays a recorded session through curvature correction, look direction and instance lookup, e.g. to compare
+# algorithm versions on identical input or to measure throughput on a machine without tracker and simulator
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays recorded gaze data without Eye-Tracker and CARLA")
+    parser.add_argument("gaze", help="Eye_Track_Log_*.csv or Eye_Track_Recording_*.eyerec file")
+    parser.add_argument("--frames", help="Segmentation_Frames_*.eyerec file with the recorded segmentation frames")
+    parser.add_argument("--screen-width", type=int, help="Screen width during the recording (default: from the recording)")
+    parser.add_argument("--screen-height", type=int, help="Screen height during the recording (default: from the recording)")
+    parser.add_argument("--rate", type=float, default=30, help="Sample rate of CSV logs, which have no timestamps (Hz)")
+    parser.add_argument("--profile", help="Curvature profile to use instead of the built-in coefficients")
+    parser.add_argument("--calibration", help="Calibration profile from calibration_profiles/, replaces --profile")
+    parser.add_argument("--smooth", action="store_true", help="Smooths the gaze with the default One Euro filter, recordings of --smooth sessions are smoothed with their own settings anyway")
+    parser.add_argument("--vote-radius", type=float, default=0, help="Majority vote radius for the instance lookup (px)")
+    parser.add_argument("--section-amount", type=int, default=16, help="Number of grid cells of the look direction")
+    parser.add_argument("--realtime", action="store_true", help="Replay at the recorded pace instead of as fast as possible")
+    parser.add_argument("--speed", type=float, default=1.0, help="Pace factor for --realtime")
+    parser.add_argument("--output", help="Write the replayed results to this recording")
+    parser.add_argument("--join", action="store_true", help="Join every frame with the gaze at its timestamp instead of the newest sample")
+    args = parser.parse_args()
+
+    screen_width, screen_height = args.screen_width, args.screen_height
+    metadata = {}
+    if not args.gaze.endswith(".csv"):
+        metadata = BinaryRecording.load(args.gaze)[0]["metadata"]
+        screen_width = screen_width or metadata.get("screen_width")
+        screen_height = screen_height or metadata.get("screen_height")
+    if screen_width is None or screen_height is None:
+        parser.error("--screen-width and --screen-height are required for this input")
+
+    correct_curvature = CorrectCurvature(screen_width=screen_width)
+    if args.profile:
+        correct_curvature.load_profile(args.profile)
+    if args.calibration:
+        correct_curvature = CalibrationMapping.load_profile(args.calibration, correct_curvature)
+
+    gaze_filter = None
+    if "gaze_filter" in metadata:
+        gaze_filter = GazeFilter(**metadata["gaze_filter"])
+    elif args.smooth:
+        gaze_filter = GazeFilter()
+
+    recorder = None
+    if args.output:
+        recorder_metadata = {"screen_width": screen_width, "screen_height": screen_height, "replay_of": args.gaze, "section_amount": args.section_amount}
+        if gaze_filter is not None:
+            recorder_metadata["gaze_filter"] = gaze_filter.settings()
+        recorder = GazeRecorder(args.output, metadata=recorder_metadata, start_time=metadata.get("start_time", 0.0))
+
+    carla_client = CarlaClient(vote_radius=args.vote_radius, screen_size=(screen_width, screen_height))
+    if args.join:
+        carla_client.gaze_join = GazeFrameJoin()
+    engine = ReplayEngine(correct_curvature, LookDirection(screen_width, screen_height), carla_client, args.section_amount, recorder, gaze_filter)
+    samples = engine.load_gaze(args.gaze, args.rate)
+    frames = engine.load_frames(args.frames) if args.frames else 0
+    print(f"Replaying {samples} samples and {frames} segmentation frames")
+
+    rate = engine.run(args.realtime, args.speed)
+    if recorder is not None:
+        recorder.close()
+
+    print(f"{rate:.0f} samples/s")
+    if gaze_filter is not None:
+        print("Gaze filter: " + gaze_filter.stats())
+    if carla_client.gaze_join is not None:
+        print("Gaze and frame join: " + carla_client.gaze_join.stats())
+    for stage, seconds in engine.stage_times.items():
+        print(f"  {stage:15} {seconds / max(samples, 1) * 1e6:8.2f} us/sample")